@@ -0,0 +1,331 @@
+"""ASGI build of the budget API, for serving many concurrent slow clients from one process:
+
+    uvicorn asgi:app
+
+It serves /api/categories, /api/transactions, /api/transactions/search, /api/changes,
+/api/summary, /api/transfer, /api/batch, /api/report and /api/events on top of the storage, planners and report generators of app.py,
+with the same request and response formats. Blocking storage work runs in a thread pool, every mutation
+goes through app.py's single writer thread without a pool thread waiting on it, reports are
+rendered a slice at a time and event streams wait on the loop, so a slow download or an
+idle subscriber holds no thread.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import parse_qsl, unquote
+
+import app as budget
+
+# Threads for blocking storage reads, commits and report rendering
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("BUDGET_ASGI_THREADS", "8")), thread_name_prefix="budget-io")
+# Report lines rendered per trip to the executor, sent as one body message
+REPORT_SLICE = 500
+
+async def blocking(function, *args):
+    """Run a blocking storage call on the executor"""
+    return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+class AsyncWriter:
+    """Hands plans to the writer thread and awaits the outcome on the event loop.
+
+    The writer batches whatever is queued into one commit, so concurrent requests still
+    share an fsync, and strict write ordering is kept across the Flask and ASGI builds.
+    """
+
+    async def submit(self, plan):
+        """Run plan(store) in the next batch and return its mutations once they are durable"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def settle(request):
+            if future.cancelled():
+                return  # The client went away, the write stands
+            if request["error"] is not None:
+                future.set_exception(request["error"])
+            else:
+                future.set_result(request["result"])
+
+        # The callback runs on the writer thread, the future is settled on the loop
+        budget.writer.enqueue(plan, lambda request: loop.call_soon_threadsafe(settle, request))
+        return await future
+
+writer = AsyncWriter()
+
+class Request:
+    """The parts of an HTTP scope the routes read"""
+
+    def __init__(self, scope, receive):
+        self.receive = receive
+        self.method = scope["method"]
+        # First value wins for repeated parameters, as with Flask's request.args
+        self.args = {}
+        for key, value in parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True):
+            self.args.setdefault(key, value)
+        self.headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+
+    async def json(self):
+        body = b""
+        more = True
+        while more:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                raise ConnectionError("Client disconnected")
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+        try:
+            return budget.app.json.loads(body or b"null")
+        except ValueError:
+            raise budget.BudgetError("Invalid JSON body")
+
+    async def json_object(self):
+        """The JSON body, for the routes that only take an object"""
+        data = await self.json()
+        if not isinstance(data, dict):
+            raise budget.BudgetError("Expected a JSON object")
+        return data
+
+async def send_json(send, payload, status=200, headers=()):
+    """Send a complete JSON response, encoded like Flask's jsonify"""
+    body = (budget.app.json.dumps(payload, separators=(",", ":")) + "\n").encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def send_error(send, error):
+    await send_json(send, {"status": "error", "message": error.message, **error.details}, error.status)
+
+def versioned(handler):
+    """Tag responses with the data version as a strong ETag and answer If-None-Match with 304"""
+    async def wrapper(request, send):
+        etag = f'"{await blocking(budget.version_tag)}"'
+        headers = [(b"etag", etag.encode()), (b"cache-control", b"no-cache")]
+        tags = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+        if etag in tags or "*" in tags:
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await handler(request, send, headers)
+    return wrapper
+
+@versioned
+async def get_categories(request, send, headers):
+    """Get all categories with their current balance"""
+    balances = await blocking(budget.store.balances)
+    categories = [{"name": name, "balance": balance} for name, balance in balances.items()]
+    await send_json(send, {"status": "success", "categories": categories}, headers=headers)
+
+async def add_category(request, send):
+    """Add a new category"""
+    category_name = (await request.json_object()).get("name", "").strip()
+    await writer.submit(lambda store: budget.plan_add_category(store, category_name))
+    await send_json(send, {
+        "status": "success",
+        "message": "Category added",
+        "category": {
+            "name": category_name,
+            "balance": 0
+        }
+    })
+
+@versioned
+async def get_transactions(request, send, headers):
+    """Get transactions, with the same filters and paging as the Flask route"""
+    await send_json(send, await blocking(budget.query_transactions, request.args), headers=headers)
+
+@versioned
+async def search_transactions(request, send, headers):
+    """Find transactions by words in their description, as the Flask route"""
+    await send_json(send, await blocking(budget.query_search, request.args), headers=headers)
+
+@versioned
+async def get_changes(request, send, headers):
+    """Get what changed after ?since=N, as the Flask route"""
+    await send_json(send, await blocking(budget.query_changes, request.args), headers=headers)
+
+@versioned
+async def get_summary(request, send, headers):
+    """Get totals per period and category, as the Flask route"""
+    await send_json(send, await blocking(budget.query_summary, request.args), headers=headers)
+
+async def add_transaction(request, send):
+    """Add a new transaction"""
+    body = await request.json_object()
+    category_name = body.get("category")
+    try:
+        amount = float(body.get("amount", 0))
+    except (TypeError, ValueError):
+        raise budget.BudgetError("Invalid amount")
+    description = body.get("description", "").strip()
+    transaction_type = body.get("type")
+
+    mutations = await writer.submit(
+        lambda store: budget.plan_add_transaction(store, category_name, amount, description, transaction_type)
+    )
+    await send_json(send, {
+        "status": "success",
+        "message": "Transaction added",
+        "transaction": mutations[0]["transactions"][0],
+        "new_balance": await blocking(budget.store.balance, category_name)
+    })
+
+async def transfer_funds(request, send):
+    """Transfer funds between categories"""
+    body = await request.json_object()
+    from_cat = body.get("from_category")
+    to_cat = body.get("to_category")
+    try:
+        amount = float(body.get("amount", 0))
+    except (TypeError, ValueError):
+        raise budget.BudgetError("Invalid amount")
+
+    await writer.submit(lambda store: budget.plan_transfer(store, from_cat, to_cat, amount))
+    await send_json(send, {
+        "status": "success",
+        "message": "Transfer completed",
+        "from_balance": await blocking(budget.store.balance, from_cat),
+        "to_balance": await blocking(budget.store.balance, to_cat)
+    })
+
+async def apply_batch(request, send):
+    """Apply an ordered list of operations all-or-nothing, in one commit"""
+    operations = budget.read_batch(await request.json())
+    steps = []
+    await writer.submit(lambda store: budget.plan_batch(store, operations, steps))
+    balances = await blocking(budget.store.balances)
+    await send_json(send, budget.batch_response(operations, steps, balances))
+
+def next_slice(report_content):
+    return "".join(islice(report_content, REPORT_SLICE))
+
+async def generate_report(request, send):
+    """Stream a txt or csv report, rendering it a slice at a time on the executor"""
+    try:
+        report_content, filename, content_type = await blocking(budget.prepare_report, request.args)
+    except budget.BudgetError as e:
+        await send_json(send, {"error": e.message}, e.status)
+        return
+    except Exception as e:
+        await send_json(send, {"status": "error", "message": "Failed to generate report", "error": str(e)}, 500)
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", content_type.encode()),
+            (b"content-disposition", f"attachment; filename={filename}".encode())
+        ]
+    })
+    try:
+        while True:
+            chunk = await blocking(next_slice, report_content)
+            if not chunk:
+                break
+            # Waits while the client is slow to read, without holding a thread
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    except Exception as e:
+        # Too late for an error response, the report is cut short
+        print(f"Report generation failed: {str(e)}")
+    finally:
+        report_content.close()
+    await send({"type": "http.response.body", "body": b""})
+
+async def stream_events(request, send):
+    """Push change events as Server-Sent Events, waiting on the loop rather than a thread"""
+    seq = await blocking(budget.events_start, request.headers.get("last-event-id"), request.args.get("since"))
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    disconnected = asyncio.Event()
+
+    def notify():
+        loop.call_soon_threadsafe(changed.set)
+
+    async def watch_disconnect():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+        changed.set()
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no")
+        ]
+    })
+    await send({"type": "http.response.body", "body": f"retry: {budget.EVENTS_RETRY_MS}\n\n".encode(), "more_body": True})
+    budget.change_feed.listeners.add(notify)
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        while not disconnected.is_set():
+            changed.clear()
+            events = budget.change_feed.since(seq)
+            if events is None:
+                events = [{"type": "reset", "seq": budget.change_feed.position()}]
+            if events:
+                body = "".join(budget.format_event(event) for event in events)
+                seq = events[-1]["seq"]
+            else:
+                try:
+                    await asyncio.wait_for(changed.wait(), budget.EVENTS_KEEPALIVE)
+                    continue
+                except asyncio.TimeoutError:
+                    body = ": keepalive\n\n"
+            await send({"type": "http.response.body", "body": body.encode(), "more_body": True})
+    finally:
+        budget.change_feed.listeners.discard(notify)
+        watcher.cancel()
+
+ROUTES = {
+    ("GET", "/api/categories"): get_categories,
+    ("POST", "/api/categories"): add_category,
+    ("GET", "/api/transactions"): get_transactions,
+    ("POST", "/api/transactions"): add_transaction,
+    ("GET", "/api/transactions/search"): search_transactions,
+    ("GET", "/api/changes"): get_changes,
+    ("GET", "/api/summary"): get_summary,
+    ("POST", "/api/transfer"): transfer_funds,
+    ("POST", "/api/batch"): apply_batch,
+    ("GET", "/api/report"): generate_report,
+    ("GET", "/api/events"): stream_events
+}
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await blocking(budget.ensure_data_file)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    path = unquote(scope["path"]).rstrip("/") or "/"
+    handler = ROUTES.get((scope["method"], path))
+    if handler is None:
+        allowed = any(route_path == path for _, route_path in ROUTES)
+        await send_json(send, {"status": "error", "message": "Method not allowed" if allowed else "Not found"},
+                        405 if allowed else 404)
+        return
+    try:
+        await handler(Request(scope, receive), send)
+    except budget.BudgetError as e:
+        await send_error(send, e)
+    except ConnectionError:
+        pass  # The client left before sending its body
+    except Exception as e:
+        await send_json(send, {"status": "error", "message": str(e)}, 500)
@@ -0,0 +1,279 @@
+"""Benchmark harness for the budget API.
+
+Generates synthetic budget_data.json datasets and drives every /api/* route through
+Flask's test client, reporting latency percentiles, throughput and peak memory as JSON
+so runs from different releases can be compared. Reports are rendered with the report
+cache off, then timed again with it on under "(cached)" names:
+
+    python bench.py --sizes 10000,100000,1000000 --categories 20 --output bench.json
+
+Each dataset size runs in a fresh process, so the app's module state and the peak
+memory figures of one size don't leak into the next.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+# Synthetic transactions are spread over this many days from START_DATE
+START_DATE = datetime(2023, 1, 1)
+DESCRIPTIONS = ["Groceries", "Bus fare", "Salary", "Rent", "Electricity", "Tea plucking pay", "School fees", "Airtime"]
+IMPORT_BATCH = 100
+# GET /api/changes?since=... is timed this many mutations behind the latest version
+CHANGES_BEHIND = 10
+# Report cache size for the "(cached)" report timings, the app's default
+CACHED_REPORTS = 32
+
+def generate_dataset(path, size, categories, days, seed):
+    """Write a format 2 data file holding size transactions, chronological like a real ledger"""
+    rng = random.Random(seed)
+    names = [f"Category {i:03d}" for i in range(categories)]
+    balances = dict.fromkeys(names, 0.0)
+    offsets = sorted(rng.randrange(days * 86400) for _ in range(size))
+    transactions = []
+    for i, offset in enumerate(offsets, 1):
+        name = rng.choice(names)
+        amount = round(rng.uniform(1, 500), 2)
+        # Withdrawals never overdraw, as the API would have refused them
+        transaction_type = "withdraw" if balances[name] >= amount and rng.random() < 0.4 else "deposit"
+        if transaction_type == "withdraw":
+            amount = -amount
+        balances[name] += amount
+        transactions.append({
+            "amount": amount,
+            "description": rng.choice(DESCRIPTIONS),
+            "date": (START_DATE + timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S"),
+            "type": transaction_type,
+            "category": name,
+            "id": i
+        })
+    data = {
+        "format": 2,
+        # As if every row was its own write, so since=0 predates the data and gets it whole
+        "seq": size,
+        "next_id": size + 1,
+        "categories": {name: {"balance": balance} for name, balance in balances.items()},
+        "transactions": transactions
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    return path
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+def summarize(latencies, peak_alloc):
+    """Latency percentiles in milliseconds plus sequential throughput for one operation"""
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    return {
+        "iterations": len(ordered),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "mean_ms": round(total / len(ordered) * 1000, 3),
+        "throughput_per_s": round(len(ordered) / total, 2) if total else None,
+        "peak_alloc_bytes": peak_alloc
+    }
+
+def measure(operation, iterations, warmup):
+    """Time operation(k) for k = 0, 1, ...; one extra traced call measures its peak allocation"""
+    k = 0
+    for _ in range(warmup):
+        operation(k)
+        k += 1
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        operation(k)
+        latencies.append(time.perf_counter() - started)
+        k += 1
+    tracemalloc.start()
+    operation(k)
+    peak_alloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return summarize(latencies, peak_alloc)
+
+def route_operations(client, names, days, version):
+    """Every /api/* route as (name, operation, is_write), reads before the writes that change the data.
+
+    GET /api/changes comes after the writes, which give it mutations to replay.
+    """
+    middle = START_DATE + timedelta(days=days // 2)
+    start, end = middle.strftime("%Y-%m-%d"), (middle + timedelta(days=30)).strftime("%Y-%m-%d")
+
+    def call(method, path, **kwargs):
+        response = client.open(path, method=method, **kwargs)
+        response.get_data()  # Drain streamed bodies inside the timed region
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    def get(path):
+        return lambda k: call("GET", path)
+
+    def import_rows(k):
+        return [{"category": names[(k + i) % len(names)], "amount": 5, "type": "deposit", "description": "Imported"}
+                for i in range(IMPORT_BATCH)]
+
+    return [
+        ("GET /api/categories", get("/api/categories"), False),
+        ("GET /api/transactions", get("/api/transactions"), False),
+        ("GET /api/transactions?category", get(f"/api/transactions?category={names[0]}"), False),
+        ("GET /api/transactions?start&end", get(f"/api/transactions?start={start}&end={end}"), False),
+        ("GET /api/transactions?limit", get("/api/transactions?limit=50"), False),
+        ("GET /api/transactions/search", get("/api/transactions/search?q=tea+pl"), False),
+        ("GET /api/transactions/search?category&start&end",
+         get(f"/api/transactions/search?q=pay&category={names[0]}&start={start}&end={end}"), False),
+        ("GET /api/report?type=txt", get("/api/report?type=txt&range=all&detailed=true"), False),
+        ("GET /api/report?type=csv", get("/api/report?type=csv&range=all"), False),
+        ("GET /api/report?range=custom", get(f"/api/report?type=txt&range=custom&start={start}&end={end}"), False),
+        ("GET /api/summary?group=month", get("/api/summary?group=month"), False),
+        ("GET /api/summary?group=day&category", get(f"/api/summary?group=day&category={names[0]}"), False),
+        ("POST /api/categories", lambda k: call("POST", "/api/categories", json={"name": f"Bench {k}"}), True),
+        ("POST /api/transactions", lambda k: call("POST", "/api/transactions", json={
+            "category": names[0], "amount": 10, "description": "Bench deposit", "type": "deposit"}), True),
+        ("POST /api/transfer", lambda k: call("POST", "/api/transfer", json={
+            "from_category": names[0], "to_category": names[1 % len(names)], "amount": 1}), True),
+        ("POST /api/transactions/import", lambda k: call("POST", "/api/transactions/import", json=import_rows(k)), True),
+        # A deposit followed by transfers out of it, in one commit
+        ("POST /api/batch", lambda k: call("POST", "/api/batch", json={"operations": [
+            {"op": "add_transaction", "category": names[0], "amount": 20, "description": "Bench batch", "type": "deposit"},
+            {"op": "transfer", "from_category": names[0], "to_category": names[1 % len(names)], "amount": 5},
+            {"op": "transfer", "from_category": names[0], "to_category": names[2 % len(names)], "amount": 5}]}), True),
+        # Removes the categories POST /api/categories created, one per call
+        ("DELETE /api/categories/<name>", lambda k: call("DELETE", f"/api/categories/Bench {k}"), True),
+        ("GET /api/changes?since", lambda k: call("GET", f"/api/changes?since={version() - CHANGES_BEHIND}"), False),
+        ("GET /api/changes?since=0 (compacted)", get("/api/changes?since=0"), False)
+    ]
+
+def run_size(options, dataset):
+    """Benchmark one dataset in this (fresh) process, returning its results"""
+    workdir = tempfile.mkdtemp(prefix="budget-bench-")
+    try:
+        data_file = os.path.join(workdir, "budget_data.json")
+        shutil.copyfile(dataset, data_file)
+        os.environ["BUDGET_DATA_FILE"] = data_file
+        os.environ["BUDGET_STORAGE"] = options["storage"]
+        os.environ["BUDGET_SNAPSHOT_FORMAT"] = options["snapshot_format"]
+        # Otherwise every timed report after the warm-up is a cache hit
+        os.environ["BUDGET_REPORT_CACHE"] = "0"
+        with open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+            import app as budget_app
+            if options["snapshot_format"] == "binary":
+                budget_app.save_data(budget_app.load_data())
+            dataset_bytes = os.path.getsize(data_file)
+            client = budget_app.app.test_client()
+            names = sorted(budget_app.store.category_names())
+
+            def load(k):
+                budget_app.load_data()
+
+            data = budget_app.load_data()
+            functions = {
+                "load_data": measure(load, options["function_iterations"], 0),
+                "save_data": measure(lambda k: budget_app.save_data(data), options["function_iterations"], 0),
+                "calculate_balance": measure(
+                    lambda k: [budget_app.calculate_balance(c) for c in data["categories"].values()],
+                    options["iterations"], options["warmup"])
+            }
+            del data
+
+            routes = {}
+            for name, operation, is_write in route_operations(client, names, options["days"], budget_app.store.version):
+                iterations = options["write_iterations"] if is_write else options["iterations"]
+                routes[name] = measure(operation, iterations, options["warmup"])
+
+            # Repeat downloads between writes, served from the cache after the warm-up call
+            budget_app.report_cache = budget_app.ReportCache(CACHED_REPORTS, budget_app.REPORT_CACHE_BYTES)
+            for name, operation, is_write in route_operations(client, names, options["days"], budget_app.store.version):
+                if name.startswith("GET /api/report"):
+                    routes[f"{name} (cached)"] = measure(operation, options["iterations"], options["warmup"])
+        peak_rss = None
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        return {
+            "dataset_bytes": dataset_bytes,
+            "peak_rss_bytes": peak_rss,
+            "functions": functions,
+            "routes": routes
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def in_fresh_process(function, *args):
+    """Run function in a new interpreter, so every size starts from a clean import of the app"""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(function, args)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated transaction counts")
+    parser.add_argument("--categories", type=int, default=20, help="categories per dataset")
+    parser.add_argument("--days", type=int, default=730, help="days the transactions are spread over")
+    parser.add_argument("--seed", type=int, default=42, help="seed for the synthetic data")
+    parser.add_argument("--iterations", type=int, default=20, help="timed calls per read route")
+    parser.add_argument("--write-iterations", type=int, default=5, help="timed calls per write route")
+    parser.add_argument("--function-iterations", type=int, default=3, help="timed calls of load_data/save_data")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed calls before each measurement")
+    parser.add_argument("--storage", default="json", choices=["json", "journal", "sqlite"])
+    parser.add_argument("--snapshot-format", default="json", choices=["json", "binary"])
+    parser.add_argument("--data-dir", help="keep generated datasets here and reuse them across runs")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    options = {
+        "storage": args.storage,
+        "snapshot_format": args.snapshot_format,
+        "iterations": args.iterations,
+        "write_iterations": args.write_iterations,
+        "function_iterations": args.function_iterations,
+        "warmup": args.warmup,
+        "days": args.days
+    }
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="budget-bench-data-")
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+    try:
+        for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+            dataset = os.path.join(data_dir, f"budget_{size}_{args.categories}_{args.days}_{args.seed}.json")
+            if not os.path.exists(dataset):
+                print(f"Generating {size} transactions...", file=sys.stderr)
+                in_fresh_process(generate_dataset, dataset, size, args.categories, args.days, args.seed)
+            print(f"Benchmarking {size} transactions...", file=sys.stderr)
+            result = in_fresh_process(run_size, options, dataset)
+            results.append({"size": size, "categories": args.categories, **result})
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": dict(options, seed=args.seed, categories=args.categories),
+        "results": results
+    }
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
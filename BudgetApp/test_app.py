@@ -0,0 +1,223 @@
+"""Regression tests for the budget API, run against a throwaway data file:
+
+    python -m pytest -q test_app.py
+"""
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+# app reads its configuration at import time
+DATA_DIR = tempfile.mkdtemp(prefix="budget-test-")
+os.environ["BUDGET_DATA_FILE"] = os.path.join(DATA_DIR, "budget_data.json")
+
+import app as budget
+import asgi
+
+def write_data(data):
+    """Put data in place of the data file, as another process would"""
+    temp_file = budget.DATA_FILE + ".test"
+    with open(temp_file, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_file, budget.DATA_FILE)
+
+class RollupTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = budget.app.test_client()
+
+    def test_category_recreated_within_one_batch(self):
+        self.client.post("/api/categories", json={"name": "Rent"})
+        # Builds the rollups, so the batch below has to keep them up to date
+        self.client.get("/api/summary")
+        response = self.client.post("/api/batch", json=[
+            {"op": "add_transaction", "category": "Rent", "amount": 5, "type": "deposit"},
+            {"op": "delete_category", "name": "Rent"},
+            {"op": "add_category", "name": "Rent"},
+            {"op": "add_transaction", "category": "Rent", "amount": 7, "type": "deposit"}
+        ])
+        self.assertEqual(response.status_code, 200, response.get_json())
+        periods = self.client.get("/api/summary?group=year&category=Rent").get_json()["periods"]
+        self.assertEqual([(row["deposits"], row["count"]) for row in periods], [(7.0, 1)])
+
+class LoadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = budget.app.test_client()
+
+    def tearDown(self):
+        write_data({"categories": {}, "transactions": []})
+
+    def test_non_iso_date_is_kept(self):
+        write_data({"categories": {"Old": {"balance": 5.0}}, "transactions": [
+            {"amount": 5.0, "description": "Legacy", "date": "05/01/2024", "type": "deposit", "category": "Old", "id": 1}
+        ]})
+        self.assertEqual(self.client.post("/api/categories", json={"name": "Fresh"}).status_code, 200)
+        with open(budget.DATA_FILE) as f:
+            saved = json.load(f)
+        self.assertEqual(sorted(saved["categories"]), ["Fresh", "Old"])
+        self.assertEqual([t["date"] for t in saved["transactions"]], ["05/01/2024"])
+        # Undated rows are in no date range, but still listed and reported
+        self.assertEqual(len(self.client.get("/api/transactions?start=2024-01-01&end=2024-12-31").get_json()["transactions"]), 0)
+        self.assertEqual(len(self.client.get("/api/transactions").get_json()["transactions"]), 1)
+        self.assertEqual(self.client.get("/api/summary").status_code, 200)
+        self.assertIn(b"Legacy", self.client.get("/api/report?type=txt&detailed=true").get_data())
+
+    def test_unloadable_file_is_not_overwritten(self):
+        write_data({"categories": ["Old"], "transactions": []})
+        with open(budget.DATA_FILE) as f:
+            before = f.read()
+        self.assertEqual(self.client.post("/api/categories", json={"name": "Fresh"}).status_code, 503)
+        with open(budget.DATA_FILE) as f:
+            self.assertEqual(f.read(), before)
+
+class ChangesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = budget.app.test_client()
+
+    def tearDown(self):
+        write_data({"categories": {}, "transactions": []})
+
+    def test_reset_store_starts_a_new_history(self):
+        self.client.post("/api/categories", json={"name": "Water"})
+        tagged = self.client.get("/api/categories")
+        before = self.client.get("/api/changes?since=0").get_json()
+        current = self.client.get(f"/api/changes?since={before['seq']}&store={before['store']}").get_json()
+        self.assertFalse(current["compacted"])
+        with open(budget.DATA_FILE, "w") as f:
+            f.write("{ corrupt")
+        self.client.post("/api/categories", json={"name": "Water"})
+        after = self.client.get(f"/api/changes?since={before['seq']}&store={before['store']}").get_json()
+        self.assertNotEqual(after["store"], before["store"])
+        self.assertTrue(after["compacted"])
+        revalidated = self.client.get("/api/categories", headers={"If-None-Match": tagged.headers["ETag"]})
+        self.assertEqual(revalidated.status_code, 200)
+
+class SnapshotTests(unittest.TestCase):
+
+    def test_binary_snapshot_round_trips_dates(self):
+        dates = ["2024-01-02 03:04:05", "2024-01-01", "2024-01-01 10:00:00.250000", "2024-01-01T10:00:00", "05/01/2024"]
+        data = {
+            "categories": {"Rent": {"balance": 5.0 * len(dates)}},
+            "transactions": [{"amount": 5.0, "description": "", "date": date, "type": "deposit", "category": "Rent", "id": i}
+                             for i, date in enumerate(dates, 1)],
+            "seq": 3,
+            "next_id": len(dates) + 1,
+            "store_id": 7
+        }
+        decoded, epochs = budget.decode_snapshot(budget.encode_snapshot(data))
+        self.assertEqual(decoded, data)
+        self.assertEqual(epochs, [budget.date_epoch(date) for date in dates])
+
+class CheckpointTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = budget.app.test_client()
+        patcher = unittest.mock.patch.object(budget, "STORAGE_MODE", "journal")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        budget.checkpoint(budget.load_data)
+        write_data({"categories": {}, "transactions": []})
+
+    def deposit(self, amount):
+        self.client.post("/api/transactions", json={"category": "Fares", "amount": amount, "type": "deposit"})
+
+    def test_compaction_skips_files_checkpointed_meanwhile(self):
+        self.client.post("/api/categories", json={"name": "Fares"})
+        self.deposit(1)
+        snapshot, offset, frozen = budget.writer.call(
+            lambda: (budget.Snapshot(budget.get_data()), budget.journal_size, budget.data_stamp()))
+        temp_file = budget.DATA_FILE + ".checkpoint.tmp"
+        budget.write_snapshot(snapshot.frozen(), temp_file)
+        # A checkpoint from the CLI lands while the background one is writing its snapshot
+        self.assertTrue(budget.checkpoint(budget.load_data))
+        self.deposit(2)
+        self.assertFalse(budget.writer.call(lambda: budget.store.compact_log(offset, temp_file, frozen)))
+        self.assertEqual(budget.load_data()["categories"]["Fares"]["balance"], 3.0)
+
+class AmountTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = budget.app.test_client()
+        self.client.post("/api/categories", json={"name": "Tea"})
+
+    def test_non_finite_amounts_are_row_errors(self):
+        response = self.client.post("/api/transactions/import", json=[
+            {"category": "Tea", "amount": "nan", "type": "deposit"},
+            {"category": "Tea", "amount": "inf"},
+            {"category": "Tea", "amount": "4"}
+        ])
+        body = response.get_json()
+        self.assertEqual(response.status_code, 200, body)
+        self.assertEqual([(error["row"], error["message"]) for error in body["errors"]],
+                         [(1, "Invalid amount"), (2, "Invalid amount")])
+        categories = self.client.get("/api/categories")
+        self.assertNotIn(b"NaN", categories.get_data())
+        self.assertEqual({c["name"]: c["balance"] for c in categories.get_json()["categories"]}["Tea"], 4.0)
+
+    def test_non_finite_deposit_is_refused(self):
+        response = self.client.post("/api/transactions", json={"category": "Tea", "amount": "nan", "type": "deposit"})
+        self.assertEqual((response.status_code, response.get_json()["message"]), (400, "Invalid amount"))
+
+class BalanceTests(unittest.TestCase):
+
+    def tearDown(self):
+        write_data({"categories": {}, "transactions": []})
+
+    def test_check_balances_repairs_drift(self):
+        write_data({"categories": {"Old": {"balance": 999.0}}, "transactions": [
+            {"amount": 5.0, "description": "", "date": "2024-05-01", "type": "deposit", "category": "Old", "id": 1}
+        ]})
+        result = budget.app.test_cli_runner().invoke(args=["check-balances"])
+        self.assertIn("Repaired balances for: Old", result.output)
+        with open(budget.DATA_FILE) as f:
+            self.assertEqual(json.load(f)["categories"]["Old"]["balance"], 5.0)
+        result = budget.app.test_cli_runner().invoke(args=["check-balances"])
+        self.assertIn("All balances consistent", result.output)
+
+class AsgiTests(unittest.TestCase):
+
+    def request(self, method, path, payload):
+        """Status and JSON body of one request to the ASGI build"""
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": json.dumps(payload).encode(), "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "query_string": b"", "headers": []}
+        asyncio.run(asgi.app(scope, receive, send))
+        return messages[0]["status"], json.loads(b"".join(message.get("body", b"") for message in messages[1:]))
+
+    def test_batch_takes_a_bare_array_like_flask(self):
+        self.request("POST", "/api/categories", {"name": "Bus"})
+        operations = [{"op": "add_transaction", "category": "Bus", "amount": 3, "type": "deposit"}]
+        status, body = self.request("POST", "/api/batch", operations)
+        self.assertEqual(status, 200, body)
+        self.assertEqual(budget.app.test_client().post("/api/batch", json=operations).status_code, 200)
+        self.assertEqual(self.request("POST", "/api/transfer", operations)[0], 400)
+
+class ProfileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = budget.app.test_client()
+
+    def test_loopback_is_not_trusted_without_a_token(self):
+        with unittest.mock.patch.object(budget, "PROFILE_TOKEN", None):
+            self.assertEqual(self.client.get("/admin/profiles").status_code, 403)
+
+    def test_token_must_match(self):
+        with unittest.mock.patch.object(budget, "PROFILE_TOKEN", "sekrit"):
+            wrong = self.client.get("/admin/profiles", headers={"Authorization": "Bearer wrong"})
+            right = self.client.get("/admin/profiles", headers={"Authorization": "Bearer sekrit"})
+        self.assertEqual((wrong.status_code, right.status_code), (403, 200))
+
+if __name__ == "__main__":
+    unittest.main()
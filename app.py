@@ -1,9 +1,38 @@
-from flask import Flask, render_template, request, jsonify, send_file, make_response
+import click
+import cProfile
+import pstats
+from flask import Flask, Response, render_template, request, jsonify, send_file, make_response, stream_with_context, g
 from io import StringIO, BytesIO
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict, deque
+from itertools import accumulate, islice
+import heapq
+import hmac
 import json
+import math
 import os
 import csv
+import queue
+import re
+import secrets
+import sqlite3
+import struct
+import sys
+import threading
+import time
 import traceback
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from types import GeneratorType
+try:
+    import fcntl
+except ImportError:  # Windows: writes are then only serialized within this process
+    fcntl = None
+try:
+    import numpy as np
+except ImportError:  # Report analytics then fall back to a plain pass over the transactions
+    np = None
 from datetime import datetime,timedelta
 
 
@@ -14,54 +43,591 @@ categories = [
     {"name": "Food", "balance": 100.00, "ledger": []},
     {"name": "Transport", "balance": 50.00, "ledger": []}
 ]
-# Absolute path to the data file
-DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "budget_data.json")
+# Absolute path to the data file, BUDGET_DATA_FILE points the app at another one (e.g. a benchmark dataset)
+DATA_FILE = os.path.abspath(os.environ.get("BUDGET_DATA_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "budget_data.json"))
 # print(f"Data will be saved to: {DATA_FILE}")
 
+# Storage mode: "json" rewrites the whole snapshot on every write, "journal"
+# appends each mutation to JOURNAL_FILE and only rewrites the snapshot on checkpoint,
+# "sqlite" keeps everything in SQLITE_FILE with indexed queries
+STORAGE_MODE = os.environ.get("BUDGET_STORAGE", "json")
+JOURNAL_FILE = DATA_FILE + ".journal"
+# Format save_data writes the snapshot in: "json" or the compact "binary" layout.
+# load_data detects either from the file contents, so the setting can change at any time
+SNAPSHOT_FORMAT = os.environ.get("BUDGET_SNAPSHOT_FORMAT", "json")
+SQLITE_FILE = os.path.splitext(DATA_FILE)[0] + ".db"
+# Cross-process lock held around every read-modify-write of the JSON store
+LOCK_FILE = DATA_FILE + ".lock"
+# How long a write waits for concurrent writes to join its commit (one fsync per batch)
+WRITE_BATCH_WINDOW = float(os.environ.get("BUDGET_WRITE_BATCH_MS", "2")) / 1000
+# How often the idle writer looks for writes made by other processes
+REFRESH_INTERVAL = float(os.environ.get("BUDGET_REFRESH_MS", "500")) / 1000
+# Background checkpoints fold the journal (or SQLite's WAL) into the main file once
+# it holds CHECKPOINT_BYTES, or CHECKPOINT_SECONDS after the last checkpoint; 0 seconds disables them
+CHECKPOINT_BYTES = int(os.environ.get("BUDGET_CHECKPOINT_BYTES", str(4 * 1024 * 1024)))
+CHECKPOINT_SECONDS = float(os.environ.get("BUDGET_CHECKPOINT_SECONDS", "60"))
+CHECKPOINT_LOCK_FILE = DATA_FILE + ".checkpoint.lock"
+# Opt-in profiling: BUDGET_PROFILE=1 profiles every request and keeps those slower than
+# PROFILE_THRESHOLD_MS; otherwise only requests carrying PROFILE_HEADER are profiled, and kept
+# whatever their duration. The header and the admin endpoints require PROFILE_TOKEN and are
+# off when it is unset. The newest PROFILE_LIMIT profiles are kept in PROFILE_DIR
+PROFILE_ALL = os.environ.get("BUDGET_PROFILE", "0") == "1"
+PROFILE_THRESHOLD_MS = float(os.environ.get("BUDGET_PROFILE_THRESHOLD_MS", "500"))
+PROFILE_TOKEN = os.environ.get("BUDGET_PROFILE_TOKEN")
+PROFILE_HEADER = "X-Budget-Profile"
+PROFILE_DIR = os.environ.get("BUDGET_PROFILE_DIR") or os.path.join(os.path.dirname(DATA_FILE), "profiles")
+PROFILE_LIMIT = int(os.environ.get("BUDGET_PROFILE_LIMIT", "50"))
+# GET /api/events keeps the last EVENTS_BACKLOG change events for clients resuming with
+# Last-Event-ID, and sends a comment every EVENTS_KEEPALIVE seconds so proxies keep idle streams open
+EVENTS_BACKLOG = int(os.environ.get("BUDGET_EVENTS_BACKLOG", "1000"))
+EVENTS_KEEPALIVE = 15
+EVENTS_RETRY_MS = 3000
+# GET /api/changes replays up to the last CHANGES_KEPT mutations; clients further behind
+# (or asking about history from before the data was loaded) get the whole data instead
+CHANGES_KEPT = int(os.environ.get("BUDGET_CHANGES_KEPT", "10000"))
+# Length of the journal's valid prefix as of the last replay or append
+journal_size = 0
+
+# Page size bounds for GET /api/transactions?limit=...
+MAX_PAGE_SIZE = 500
+# Operations accepted by one POST /api/batch
+MAX_BATCH_OPERATIONS = 1000
+TRANSACTION_FIELDS = ("id", "amount", "description", "date", "type", "category")
+
+# Reference point for the epoch seconds kept in the date index
+EPOCH = datetime(1970, 1, 1)
+# Epoch of stored dates that don't parse (older files took any string): such rows sort
+# first in the date index and fall in no date range
+UNDATED = float("-inf")
+
+# Period lengths GET /api/summary can group by; ISO weeks start on Monday
+ROLLUP_GROUPS = ("day", "week", "month", "year")
+
+# Resident copy of the data, reused across requests until the files on disk change
+data_cache = {"data": None, "stamp": None}
+# Columnar copy of the transactions for report analytics (NumPy only), built on first use
+column_cache = {"view": None, "lock": threading.Lock()}
+# Words of a description for GET /api/transactions/search: runs of letters and digits, as
+# SQLite's FTS5 tokenizer splits them
+SEARCH_TOKEN = re.compile(r"[^\W_]+")
+# A searched date range holding at most this many transactions is looked up first, so SQLite
+# walks only the matches between its lowest and highest id
+SEARCH_NARROW_ROWS = 50000
+# A searched category holding at most this many transactions is scanned newest first instead,
+# as a common word's matches may hold few of its rows
+SEARCH_SCAN_ROWS = 2000
+
+# Rows listed under "Top Spending" in detailed reports
+TOP_DESCRIPTIONS = 10
+# Rendered reports kept for repeat downloads until the next write: at most REPORT_CACHE_ENTRIES
+# of them and REPORT_CACHE_BYTES in total (counted in characters); 0 entries disables the cache
+REPORT_CACHE_ENTRIES = int(os.environ.get("BUDGET_REPORT_CACHE", "32"))
+REPORT_CACHE_BYTES = int(os.environ.get("BUDGET_REPORT_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Upper bounds (seconds) of the latency histogram buckets exposed on /metrics
+METRIC_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRIC_HELP = {
+    "budget_http_requests_total": ("counter", "HTTP requests handled, by route and status"),
+    "budget_http_request_duration_seconds": ("histogram", "Time to handle a request, including streaming the body"),
+    "budget_load_data_duration_seconds": ("histogram", "Time load_data spent reading and indexing the data file"),
+    "budget_load_data_bytes_total": ("counter", "Bytes of data file read by load_data"),
+    "budget_save_data_duration_seconds": ("histogram", "Time save_data spent writing a snapshot"),
+    "budget_save_data_bytes_total": ("counter", "Bytes of snapshot written by save_data"),
+    "budget_fsync_duration_seconds": ("histogram", "Time spent in fsync (for SQLite, in COMMIT), by file"),
+    "budget_checkpoint_duration_seconds": ("histogram", "Time a background checkpoint took"),
+    "budget_file_bytes": ("gauge", "Size of each storage file on disk"),
+    "budget_transactions": ("gauge", "Transactions currently stored"),
+    "budget_categories": ("gauge", "Categories currently stored"),
+    "budget_data_version": ("gauge", "Sequence number of the last committed write"),
+    "budget_report_cache_hits_total": ("counter", "Reports served from the report cache"),
+    "budget_report_cache_misses_total": ("counter", "Reports rendered because the report cache didn't hold them"),
+    "budget_report_cache_entries": ("gauge", "Reports in the report cache"),
+    "budget_report_cache_bytes": ("gauge", "Characters of report held by the report cache")
+}
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus style"""
+
+    def __init__(self):
+        self.counts = [0] * (len(METRIC_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(METRIC_BUCKETS, value)] += 1
+        self.sum += value
+
+class Metrics:
+    """Process-wide counters and histograms, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self, gauges=()):
+        """Exposition text for everything recorded so far plus gauges, a list of (name, labels, value)"""
+        samples = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append((name, labels, value))
+            for (name, labels), histogram in self.histograms.items():
+                lines = samples.setdefault(name, [])
+                for bound, count in zip(METRIC_BUCKETS + ("+Inf",), accumulate(histogram.counts)):
+                    lines.append((name + "_bucket", labels + (("le", str(bound)),), count))
+                lines.append((name + "_sum", labels, histogram.sum))
+                lines.append((name + "_count", labels, sum(histogram.counts)))
+        for name, labels, value in gauges:
+            samples.setdefault(name, []).append((name, tuple(sorted(labels.items())), value))
+        out = []
+        for name in sorted(samples):
+            metric_type, help_text = METRIC_HELP.get(name, ("untyped", name))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {metric_type}")
+            for sample, labels, value in samples[name]:
+                label_text = ",".join(f'{key}="{metric_label(label_value)}"' for key, label_value in labels)
+                out.append(f"{sample}{{{label_text}}} {value}" if label_text else f"{sample} {value}")
+        return "\n".join(out) + "\n"
+
+def metric_label(value):
+    """Escape a label value for the exposition format"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+metrics = Metrics()
+
 def ensure_data_file():
     """Create data file with initial structure if it doesn't exist"""
     if not os.path.exists(DATA_FILE):
-        initial_data = {"categories": {}, "transactions": []}
+        initial_data = {"categories": {}, "transactions": [], "store_id": new_store_id()}
         with open(DATA_FILE, 'w') as f:
             json.dump(initial_data, f, indent=4)
         print("Created new data file")
 
-def load_data():
-    """Load data from file with error handling"""
+def empty_data():
+    """In-memory layout of a store with no categories yet"""
+    return {"categories": {}, "transactions": [], "seq": 0, "next_id": 1, "store_id": new_store_id(),
+            "date_index": {"epochs": [], "positions": []}, "changes": []}
+
+def new_store_id():
+    """Random id of a store's history: seqs of different stores (after a reset or a migration) are unrelated"""
+    return secrets.randbits(63)
+
+def normalize_data(data):
+    """Fold the legacy layout, where every ledger held its own copy of each transaction, into one table"""
+    unmatched = Counter(json.dumps(t, sort_keys=True) for t in data["transactions"])
+    for name, category in data["categories"].items():
+        for t in category.get("ledger", []):
+            if not isinstance(t, dict):
+                continue
+            t = dict(t, category=t.get("category", name))
+            key = json.dumps(t, sort_keys=True)
+            # Entries only present in a ledger are kept rather than silently lost
+            if unmatched[key]:
+                unmatched[key] -= 1
+            else:
+                data["transactions"].append(t)
+
+def assign_ids(data):
+    """Give transactions from older files a stable id, in table order"""
+    next_id = max([data.get("next_id", 1)] + [t["id"] + 1 for t in data["transactions"] if "id" in t])
+    for t in data["transactions"]:
+        if "id" not in t:
+            t["id"] = next_id
+            next_id += 1
+    data["next_id"] = next_id
+
+def date_epoch(value):
+    """Seconds since EPOCH for a stored date string ('%Y-%m-%d %H:%M:%S' or '%Y-%m-%d'), UNDATED if it doesn't parse"""
+    try:
+        return (datetime.fromisoformat(value) - EPOCH).total_seconds()
+    except (TypeError, ValueError):
+        return UNDATED
+
+def build_date_index(data, epochs=None):
+    """Rebuild the chronological index: epoch seconds with the table positions they belong to"""
+    if epochs is None:
+        epochs = [date_epoch(t.get("date")) for t in data["transactions"]]
+    # Stable sort of positions: equal dates keep table order, and an already chronological table sorts in O(n)
+    positions = sorted(range(len(epochs)), key=epochs.__getitem__)
+    data["date_index"] = {
+        "epochs": [epochs[i] for i in positions],
+        "positions": positions
+    }
+
+def day_epochs(start_date, end_date):
+    """Epoch seconds of the first moment of start_date and the last of end_date"""
+    return ((datetime.combine(start_date, datetime.min.time()) - EPOCH).total_seconds(),
+            (datetime.combine(end_date, datetime.max.time()) - EPOCH).total_seconds())
+
+def build_ledgers(data):
+    """Rebuild each category's ledger as a list of positions in the transactions table"""
+    for category in data["categories"].values():
+        category["ledger"] = []
+    for i, t in enumerate(data["transactions"]):
+        category = data["categories"].get(t["category"])
+        if category is not None:
+            category["ledger"].append(i)
+
+@lru_cache(maxsize=4096)
+def iso_week(day):
+    year, week, _ = datetime.fromisoformat(day).isocalendar()
+    return f"{year}-W{week:02d}"
+
+def rollup_periods(date):
+    """The day, week, month and year (as in ROLLUP_GROUPS) a stored date string falls in, none if it doesn't parse"""
+    day = date[:10]
+    try:
+        week = iso_week(day)
+    except ValueError:
+        return ()
+    return day, week, date[:7], date[:4]
+
+def rollup_amounts(t):
+    """A transaction's share of its periods' (deposits, withdrawals, transfers, count)"""
+    amount = t["amount"]
+    if t["type"] in ("transfer_in", "transfer_out"):
+        return 0.0, 0.0, amount, 1
+    if amount >= 0:
+        return amount, 0.0, 0.0, 1
+    return 0.0, amount, 0.0, 1
+
+def new_rollups():
+    # groups: {group: {category: {period: (deposits, withdrawals, transfers, count)}}}; owned holds
+    # the (group, category) dicts made since the last publish, which may be changed in place
+    return {"groups": {group: {} for group in ROLLUP_GROUPS}, "owned": set()}
+
+def rollup_transaction(rollups, t):
+    """Add a transaction to the running totals of each period it falls in"""
+    add_to_rollups(rollups, t["category"], t["date"], rollup_amounts(t))
+
+def add_to_rollups(rollups, name, date, amounts):
+    for group, period in zip(ROLLUP_GROUPS, rollup_periods(date)):
+        categories = rollups["groups"][group]
+        periods = categories.get(name)
+        if (group, name) not in rollups["owned"]:
+            # Published snapshots still read the old dict, so the totals go into a copy
+            periods = categories[name] = dict(periods or {})
+            rollups["owned"].add((group, name))
+        old = periods.get(period)
+        periods[period] = amounts if old is None else tuple(a + b for a, b in zip(old, amounts))
+
+def build_rollups(transactions):
+    """Rollups from scratch: transactions are totalled per day, and the days into the longer periods"""
+    days = {}
+    for t in transactions:
+        key = (t["category"], t["date"][:10])
+        amounts = rollup_amounts(t)
+        totals = days.get(key)
+        if totals is None:
+            days[key] = list(amounts)
+        else:
+            totals[0] += amounts[0]
+            totals[1] += amounts[1]
+            totals[2] += amounts[2]
+            totals[3] += 1
+    rollups = new_rollups()
+    for (name, day), totals in days.items():
+        add_to_rollups(rollups, name, day, tuple(totals))
+    return rollups
+
+def summary_row(period, category, totals):
+    deposits, withdrawals, transfers, count = totals
+    return {
+        "period": period,
+        "category": category,
+        "deposits": deposits,
+        "withdrawals": withdrawals,
+        "transfers": transfers,
+        "net": deposits + withdrawals + transfers,
+        "count": count
+    }
+
+def search_tokens(text):
+    """The distinct words of text, case-folded"""
+    return set(SEARCH_TOKEN.findall(text.casefold()))
+
+def build_search_index(transactions):
+    """Inverted index over the descriptions: each word with the ascending table positions it occurs at"""
+    postings = {}
+    for position, t in enumerate(transactions):
+        for word in search_tokens(t.get("description", "")):
+            positions = postings.get(word)
+            if positions is None:
+                positions = postings[word] = array("q")
+            positions.append(position)
+    # vocab lists the words in order for prefix lookups; while shared, published snapshots read
+    # it, so a new word goes into a copy
+    return {"vocab": sorted(postings), "postings": postings, "shared": False}
+
+def index_transaction(index, position, t):
+    """Add a transaction appended at position to the search index"""
+    for word in search_tokens(t.get("description", "")):
+        positions = index["postings"].get(word)
+        if positions is None:
+            if index["shared"]:
+                index["vocab"] = list(index["vocab"])
+                index["shared"] = False
+            insort(index["vocab"], word)
+            positions = index["postings"][word] = array("q")
+        positions.append(position)
+
+def serialize_data(data):
+    """On-disk layout: each transaction is stored once, categories only carry their balance"""
+    return {
+        "format": 2,
+        "seq": data["seq"],
+        "next_id": data["next_id"],
+        "store_id": data["store_id"],
+        "categories": {name: {"balance": category["balance"]} for name, category in data["categories"].items()},
+        "transactions": data["transactions"]
+    }
+
+SNAPSHOT_MAGIC = b"BDGTSNAP"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<8sHQQIIIQ")
+
+class SnapshotError(ValueError):
+    """A binary snapshot that can't be decoded"""
+
+def pack_column(values, typecode):
+    """Serialize a column as a little-endian array, prefixed with its byte length"""
+    column = array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    raw = column.tobytes()
+    return struct.pack("<Q", len(raw)) + raw
+
+def pack_strings(values):
+    """Serialize strings as a column of lengths (in characters) plus one UTF-8 blob"""
+    return pack_column(map(len, values), 'I') + pack_blob("".join(values))
+
+def pack_blob(text):
+    """Serialize text as UTF-8, prefixed with its byte length"""
+    raw = text.encode("utf-8", "surrogatepass")
+    return struct.pack("<Q", len(raw)) + raw
+
+def encode_snapshot(data):
+    """Compact columnar snapshot: names interned to integer ids, dates as integer epoch seconds.
+
+    Dates not in the '%Y-%m-%d %H:%M:%S' form the epochs rebuild are also kept as written,
+    by row, after the columns.
+    """
+    names = list(data["categories"])
+    name_ids = {name: i for i, name in enumerate(names)}
+    types, type_ids = [], {}
+    transactions = data["transactions"]
+    category_column, type_column, epochs = [], [], []
+    odd_rows, odd_dates = [], []
+    for i, t in enumerate(transactions):
+        if t["category"] not in name_ids:
+            # Orphaned rows keep their category name, it just isn't listed as a category
+            name_ids[t["category"]] = len(names)
+            names.append(t["category"])
+        category_column.append(name_ids[t["category"]])
+        if t["type"] not in type_ids:
+            type_ids[t["type"]] = len(types)
+            types.append(t["type"])
+        type_column.append(type_ids[t["type"]])
+        date = t["date"]
+        epoch = date_epoch(date)
+        if epoch == UNDATED or not plain_date(date):
+            odd_rows.append(i)
+            odd_dates.append(date)
+            epoch = 0 if epoch == UNDATED else epoch
+        epochs.append(int(epoch))
+    header = SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, data["seq"], data["next_id"],
+        len(data["categories"]), len(names), len(types), len(transactions)
+    )
+    return b"".join([
+        header,
+        pack_strings(names),
+        pack_column([category["balance"] for category in data["categories"].values()], 'd'),
+        pack_strings(types),
+        pack_column([t["id"] for t in transactions], 'q'),
+        pack_column([t["amount"] for t in transactions], 'd'),
+        pack_column(epochs, 'q'),
+        pack_column(category_column, 'I'),
+        pack_column(type_column, 'B'),
+        pack_strings([t["description"] for t in transactions]),
+        pack_column(odd_rows, 'Q'),
+        pack_strings(odd_dates),
+        pack_column([data["store_id"]], 'Q')
+    ])
+
+def plain_date(date):
+    """Whether a parsed date is written exactly as '%Y-%m-%d %H:%M:%S', which decode_snapshot rebuilds"""
+    return (len(date) == 19 and date[4] == "-" and date[7] == "-" and date[10] == " "
+            and date[13] == ":" and date[16] == ":" and date >= "1000")
+
+def clock_strings(cache=[]):
+    """'HH:MM:SS' for every second of the day, built once per process"""
+    if not cache:
+        cache.extend(f"{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}" for second in range(86400))
+    return cache
+
+def decode_snapshot(raw):
+    """Inverse of encode_snapshot, returning the data and the epoch column for the date index"""
+    try:
+        magic, version, seq, next_id, category_count, name_count, type_count, count = SNAPSHOT_HEADER.unpack_from(raw)
+        if version not in (1, SNAPSHOT_VERSION):
+            raise SnapshotError(f"Unsupported snapshot version {version}")
+        offset = SNAPSHOT_HEADER.size
+
+        def take():
+            nonlocal offset
+            size, = struct.unpack_from("<Q", raw, offset)
+            offset += 8 + size
+            if offset > len(raw):
+                raise SnapshotError("Snapshot is truncated")
+            return raw[offset - size:offset]
+
+        def column(typecode):
+            values = array(typecode)
+            values.frombytes(take())
+            if sys.byteorder == "big":
+                values.byteswap()
+            return values
+
+        def strings():
+            lengths = column('I')
+            text = take().decode("utf-8", "surrogatepass")
+            ends = list(accumulate(lengths))
+            return [text[end - length:end] for end, length in zip(ends, lengths)]
+
+        names = strings()
+        balances = column('d')
+        types = strings()
+        ids, amounts, epochs = column('q'), column('d'), column('q')
+        category_column, type_column = column('I'), column('B')
+        descriptions = strings()
+        # Version 1 had no dates kept as written and no store id
+        odd_rows, odd_dates, store_ids = (column('Q'), strings(), column('Q')) if version > 1 else ((), [], ())
+    except struct.error as e:
+        raise SnapshotError(f"Snapshot is truncated: {e}")
+    if not (len(names) == name_count and len(types) == type_count and len(balances) == category_count
+            and all(len(c) == count for c in (ids, amounts, epochs, category_column, type_column, descriptions))
+            and len(odd_rows) == len(odd_dates) and all(row < count for row in odd_rows) and len(store_ids) == (version > 1)):
+        raise SnapshotError("Snapshot columns don't match its header")
+
+    # Dates are rebuilt from a day part (one strftime per distinct day) and a time-of-day part
+    days = {day: (EPOCH + timedelta(days=day)).strftime("%Y-%m-%d ") for day in {epoch // 86400 for epoch in epochs}}
+    clocks = clock_strings()
+    dates = [days[epoch // 86400] + clocks[epoch % 86400] for epoch in epochs]
+    if odd_rows:
+        epochs = list(epochs)
+        for row, date in zip(odd_rows, odd_dates):
+            dates[row] = date
+            epochs[row] = date_epoch(date)
+
+    transactions = [
+        {"amount": amount, "description": description, "date": date,
+         "type": types[type_id], "category": names[name_id], "id": transaction_id}
+        for transaction_id, amount, description, date, name_id, type_id
+        in zip(ids, amounts, descriptions, dates, category_column, type_column)
+    ]
+    data = {
+        "categories": {names[i]: {"balance": balances[i]} for i in range(category_count)},
+        "transactions": transactions,
+        "seq": seq,
+        "next_id": next_id
+    }
+    if store_ids:
+        data["store_id"] = store_ids[0]
+    return data, list(epochs)
+
+def load_data(rebuild=True):
+    """Load data from file with error handling; rebuild=False keeps the stored balances as found"""
+    started = time.perf_counter()
     try:
         ensure_data_file()
-        with open(DATA_FILE, 'r') as f:
-            data = json.load(f)
+        with open(DATA_FILE, 'rb') as f:
+            raw = f.read()
+        metrics.inc("budget_load_data_bytes_total", len(raw))
+        epochs = None
+        if raw.startswith(SNAPSHOT_MAGIC):
+            data, epochs = decode_snapshot(raw)
+        else:
+            data = json.loads(raw)
             # Backward compatibility check
             if "transactions" not in data:
                 data["transactions"] = []
-            return data
-    except json.JSONDecodeError:
+            data.setdefault("seq", 0)
+            if data.get("format", 1) < 2:
+                normalize_data(data)
+        # Files from before store ids get one, written out with their next snapshot
+        data.setdefault("store_id", new_store_id())
+        assign_ids(data)
+        build_ledgers(data)
+        build_date_index(data, epochs)
+        # The change log starts at the snapshot, and picks up the journal as it is replayed
+        data["changes"] = []
+        replay_journal(data)
+        if rebuild:
+            drifted = rebuild_balances(data)
+            if drifted:
+                print(f"Rebuilt balances for: {', '.join(drifted)}")
+        metrics.observe("budget_load_data_duration_seconds", time.perf_counter() - started)
+        return data
+    except (json.JSONDecodeError, SnapshotError):
         print("Data file corrupted, resetting...")
         backup = DATA_FILE + ".bak"
         if os.path.exists(DATA_FILE):
             os.rename(DATA_FILE, backup)
-        ensure_data_file()
-        return {"categories": {}, "transactions": []}
+        # Saved straight away, so every process agrees on the new store id
+        data = empty_data()
+        save_data(data)
+        return data
     except Exception as e:
         print(f"Error loading data: {str(e)}")
-        return {"categories": {}, "transactions": []}
+        # Empty data here would be saved over the file by the next write
+        raise BudgetError("Data file could not be loaded", 503) from e
+
+def write_snapshot(data, path, snapshot_format=None):
+    """Write data to path in the snapshot format and fsync it"""
+    if (snapshot_format or SNAPSHOT_FORMAT) == "binary":
+        mode, content = 'wb', encode_snapshot(data)
+    else:
+        mode, content = 'w', json.dumps(serialize_data(data), indent=4)
+
+    with open(path, mode) as f:
+        f.write(content)
+        f.flush()  # Ensure data is written
+        with metrics.timer("budget_fsync_duration_seconds", file="snapshot"):
+            os.fsync(f.fileno())  # Force write to disk
+        metrics.inc("budget_save_data_bytes_total", f.tell())
 
-def save_data(data):
+def save_data(data, snapshot_format=None):
     """Save data to file atomically"""
+    started = time.perf_counter()
     try:
         temp_file = DATA_FILE + ".tmp"
+        write_snapshot(data, temp_file, snapshot_format)
         
-        # Write to temporary file
-        with open(temp_file, 'w') as f:
-            json.dump(data, f, indent=4)
-            f.flush()  # Ensure data is written
-            os.fsync(f.fileno())  # Force write to disk
-        
-        # Replace original file
-        if os.path.exists(DATA_FILE):
-            os.remove(DATA_FILE)
-        os.rename(temp_file, DATA_FILE)
+        # Replace original file in one step, other processes never see it missing
+        os.replace(temp_file, DATA_FILE)
+        metrics.observe("budget_save_data_duration_seconds", time.perf_counter() - started)
         
         print("Data saved successfully")
         return True
@@ -69,9 +635,1759 @@ def save_data(data):
         print(f"Error saving data: {str(e)}")
         return False
 
+def apply_mutation(data, mutation):
+    """Apply a single journal record to the in-memory data"""
+    op = mutation["op"]
+    if op == "add_category":
+        data["categories"][mutation["name"]] = {"ledger": [], "balance": 0}
+    elif op == "add_transactions":
+        for t in mutation["transactions"]:
+            # Ids are handed out here so they are already in the record when it is journaled
+            t.setdefault("id", data["next_id"])
+            data["next_id"] = max(data["next_id"], t["id"] + 1)
+            category = data["categories"][t["category"]]
+            position = len(data["transactions"])
+            category["ledger"].append(position)
+            category["balance"] = category.get("balance", 0) + t["amount"]
+            data["transactions"].append(t)
+            index = data["date_index"]
+            epoch = date_epoch(t["date"])
+            if not index["epochs"] or epoch >= index["epochs"][-1]:
+                index["epochs"].append(epoch)
+                index["positions"].append(position)
+            else:
+                # Back-dated entry: keep both lists sorted together
+                if index.get("shared"):
+                    # Published snapshots still read these lists, so insert into copies
+                    index = data["date_index"] = {"epochs": list(index["epochs"]), "positions": list(index["positions"])}
+                at = bisect_right(index["epochs"], epoch)
+                index["epochs"].insert(at, epoch)
+                index["positions"].insert(at, position)
+            if data.get("rollups") is not None:
+                rollup_transaction(data["rollups"], t)
+            if data.get("search_index") is not None:
+                index_transaction(data["search_index"], position, t)
+    elif op == "delete_category":
+        del data["categories"][mutation["name"]]
+        data["transactions"] = [
+            t for t in data["transactions"]
+            if t["category"] != mutation["name"]
+        ]
+        # Positions after the removed rows have shifted
+        build_ledgers(data)
+        build_date_index(data)
+        if data.get("rollups") is not None:
+            for group, categories in data["rollups"]["groups"].items():
+                categories.pop(mutation["name"], None)
+                # A category of the same name added later starts from a fresh dict
+                data["rollups"]["owned"].discard((group, mutation["name"]))
+        if data.get("search_index") is not None:
+            data["search_index"] = build_search_index(data["transactions"])
+    else:
+        raise ValueError(f"Unknown journal operation: {op}")
+    data["seq"] = mutation["seq"]
+    changes = data["changes"]
+    if len(changes) >= 2 * CHANGES_KEPT:
+        # Published snapshots still read the old log, so the trimmed one is a new list
+        changes = data["changes"] = changes[-CHANGES_KEPT:]
+    changes.append(mutation)
+
+def replay_journal(data):
+    """Apply journal records newer than the snapshot, stopping at a torn or in-flight tail"""
+    global journal_size
+    journal_size = 0
+    if not os.path.exists(JOURNAL_FILE):
+        return
+    good_offset = 0
+    with open(JOURNAL_FILE, 'rb') as f:
+        for line in f:
+            try:
+                mutation = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            good_offset += len(line)
+            # Records already folded into the snapshot by a checkpoint are skipped
+            if mutation["seq"] > data["seq"]:
+                apply_mutation(data, mutation)
+    # Readers don't hold the write lock, so a partial tail may be another process mid-append;
+    # it is only cut off by the next append, which does hold the lock
+    journal_size = good_offset
+
+def append_journal(mutations):
+    """Append mutation records to the journal and fsync, without touching the snapshot"""
+    global journal_size
+    try:
+        with open(JOURNAL_FILE, 'ab') as f:
+            if f.tell() > journal_size:
+                print("Journal has a torn record, truncating...")
+                f.truncate(journal_size)
+            f.write("".join(json.dumps(m, separators=(',', ':')) + "\n" for m in mutations).encode())
+            f.flush()
+            with metrics.timer("budget_fsync_duration_seconds", file="journal"):
+                os.fsync(f.fileno())
+            journal_size = f.tell()
+        return True
+    except Exception as e:
+        print(f"Error writing journal: {str(e)}")
+        return False
+
+def checkpoint(prepare, snapshot_format=None):
+    """Write a fresh snapshot of prepare()'s data and discard the journal records it now contains.
+
+    Takes CHECKPOINT_LOCK_FILE and then the write lock, through the writer, in the same order
+    as a background checkpoint, so the two never interleave. prepare runs on the writer
+    thread and may return None when there is nothing to write.
+    """
+    def replace():
+        global journal_size
+        data = prepare()
+        if data is None:
+            return True
+        if not save_data(data, snapshot_format):
+            return False
+        if os.path.exists(JOURNAL_FILE):
+            os.truncate(JOURNAL_FILE, 0)
+        journal_size = 0
+        return True
+
+    with lock_file(CHECKPOINT_LOCK_FILE):
+        return writer.call(replace)
+
+def compact_journal(offset):
+    """Drop the first offset bytes of the journal, already folded into the snapshot.
+
+    The caller holds the write lock and has synced journal_size with the file.
+    """
+    global journal_size
+    with open(JOURNAL_FILE, 'rb') as f:
+        f.seek(offset)
+        tail = f.read(journal_size - offset)
+    temp_file = JOURNAL_FILE + ".tmp"
+    with open(temp_file, 'wb') as f:
+        f.write(tail)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, JOURNAL_FILE)
+    journal_size -= offset
+
+def stage(data, mutations):
+    """Apply mutations to the in-memory data, numbering them with the next sequence numbers"""
+    for mutation in mutations:
+        mutation["seq"] = data["seq"] + 1
+        apply_mutation(data, mutation)
+
+def persist(data, mutations):
+    """Make mutations already applied to data durable using the configured storage mode"""
+    if STORAGE_MODE != "journal":
+        saved = save_data(data)
+    else:
+        # Folding the journal into the snapshot is left to the background checkpointer
+        saved = append_journal(mutations)
+    if saved:
+        # Our own write is already in memory, no need to parse it back
+        data_cache["data"] = data
+        data_cache["stamp"] = data_stamp()
+    else:
+        # The in-memory copy is ahead of the disk, reload on next access
+        data_cache["data"] = None
+    return saved
+
+def data_stamp():
+    """Identify the on-disk state by inode, mtime and size of the snapshot and journal"""
+    stamp = []
+    for path in (DATA_FILE, JOURNAL_FILE):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def get_data():
+    """Return the cached data, reloading it only when the files on disk have changed"""
+    stamp = data_stamp()
+    if data_cache["data"] is None or data_cache["stamp"] != stamp:
+        # Stamp taken before loading, so a write racing the load forces another reload
+        data_cache["data"] = load_data()
+        data_cache["stamp"] = stamp
+    return data_cache["data"]
+
 def calculate_balance(category):
-    """Calculate current balance for a category"""
-    return sum(item["amount"] for item in category["ledger"])
+    """Get current balance for a category"""
+    return category["balance"]
+
+def rebuild_balances(data):
+    """Recompute running balances from the ledgers, returning the categories that had drifted"""
+    drifted = []
+    transactions = data["transactions"]
+    for name, category in data["categories"].items():
+        balance = sum(transactions[i]["amount"] for i in category["ledger"])
+        if category.get("balance") != balance:
+            if "balance" in category:
+                drifted.append(name)
+            category["balance"] = balance
+    return drifted
+
+class Snapshot:
+    """Read-only view of the JSON data as of one commit, shared by readers without locks.
+
+    The writer only appends to the transactions table, the ledgers and the date index in
+    place; a delete or a back-dated entry puts new lists in their place instead. So a
+    snapshot holds on to the lists themselves along with their lengths when it was taken,
+    and later appends stay out of its view. The search index's postings are cut off at the
+    snapshot's table size the same way.
+    """
+
+    def __init__(self, data):
+        self.seq = data["seq"]
+        self.next_id = data["next_id"]
+        self.store_id = data["store_id"]
+        self.table = data["transactions"]
+        self.size = len(self.table)
+        self.balances = {name: calculate_balance(category) for name, category in data["categories"].items()}
+        self.ledgers = {name: (category["ledger"], len(category["ledger"])) for name, category in data["categories"].items()}
+        index = data["date_index"]
+        self.epochs = index["epochs"]
+        self.by_date = index["positions"]
+        self.indexed = len(self.epochs)
+        self.changes = data["changes"]
+        self.logged = len(self.changes)
+        # The writer changes only the per-category dicts it owns, so two levels of copying isolate the rest
+        rollups = data.get("rollups")
+        self.rollups = None if rollups is None else {
+            group: dict(categories) for group, categories in rollups["groups"].items()
+        }
+        # New words go into a copy of vocab, and a delete replaces the whole index
+        search_index = data.get("search_index")
+        self.vocab = None if search_index is None else search_index["vocab"]
+        self.postings = None if search_index is None else search_index["postings"]
+
+    def changes_since(self, seq):
+        """The mutations after seq, or None when the change log doesn't reach back that far"""
+        # The log holds one mutation per sequence number, in order, up to this snapshot
+        floor = self.changes[0]["seq"] - 1 if self.logged else self.seq
+        if seq < floor or seq > self.seq:
+            return None
+        return self.changes[seq - floor:self.logged]
+
+    def date_range(self, start_date, end_date):
+        """Table positions dated between start_date and end_date inclusive, in date order"""
+        lo, hi = self.date_bounds(start_date, end_date)
+        return self.by_date[lo:hi]
+
+    def date_bounds(self, start_date, end_date):
+        """The slice of the date index covering start_date to end_date inclusive"""
+        first, last = day_epochs(start_date, end_date)
+        return bisect_left(self.epochs, first, 0, self.indexed), bisect_right(self.epochs, last, 0, self.indexed)
+
+    def date_slot(self, epoch, position):
+        """Where the row at position sits in the date index; equal dates are in table order"""
+        slot = bisect_left(self.epochs, epoch, 0, self.indexed)
+        while slot < self.indexed and self.epochs[slot] == epoch and self.by_date[slot] < position:
+            slot += 1
+        return slot
+
+    def word_postings(self, prefix, end):
+        """(positions, count) for every indexed word starting with prefix, counting positions before end"""
+        found = []
+        for i in range(bisect_left(self.vocab, prefix), len(self.vocab)):
+            word = self.vocab[i]
+            if not word.startswith(prefix):
+                break
+            positions = self.postings[word]
+            found.append((positions, bisect_left(positions, end)))
+        return found
+
+    def frozen(self):
+        """The snapshot in the shape save_data writes out"""
+        return {
+            "categories": {name: {"balance": balance} for name, balance in self.balances.items()},
+            "transactions": self.table[:self.size],
+            "seq": self.seq,
+            "next_id": self.next_id,
+            "store_id": self.store_id
+        }
+
+class JsonStore:
+    """Store backed by the resident JSON data (snapshot plus optional journal).
+
+    Only the writer thread touches the data itself; readers get the Snapshot it published
+    last, without locks or disk access.
+    """
+
+    def __init__(self):
+        self.current = None
+        self.ready = threading.Event()
+        self.error = None
+        self.batch = None
+
+    def snapshot(self):
+        if self.batch is not None and threading.current_thread() is writer.thread:
+            # Plans see the batch so far, including mutations staged before them
+            return Snapshot(self.batch[0])
+        if self.current is None:
+            writer.start()
+            self.ready.wait()
+            if self.current is None:
+                raise self.error
+        return self.current
+
+    def publish(self):
+        """Make the latest data visible to readers; runs on the writer thread"""
+        try:
+            data = get_data()
+        except BudgetError as e:
+            # Readers waiting for a first snapshot get the error; later ones keep the last good one
+            self.error = e
+            self.ready.set()
+            raise
+        current = self.current
+        built = current is not None and (
+            (current.rollups is None and data.get("rollups") is not None) or
+            (current.vocab is None and data.get("search_index") is not None)
+        )
+        if current is None or current.table is not data["transactions"] or current.seq != data["seq"] or built:
+            # From now on back-dated entries must copy the date index rather than insert into it,
+            # changed totals must copy their rollup dicts and new words the search vocabulary
+            data["date_index"]["shared"] = True
+            if data.get("rollups") is not None:
+                data["rollups"]["owned"] = set()
+            if data.get("search_index") is not None:
+                data["search_index"]["shared"] = True
+            self.current = Snapshot(data)
+            self.ready.set()
+
+    def version(self):
+        # The sequence number of the last applied mutation, bumped by every write
+        return self.snapshot().seq
+
+    def category_names(self):
+        return list(self.snapshot().balances)
+
+    def transaction_count(self):
+        return self.snapshot().size
+
+    def has_category(self, name):
+        return name in self.snapshot().balances
+
+    def balance(self, name):
+        return self.snapshot().balances[name]
+
+    def balances(self):
+        return dict(self.snapshot().balances)
+
+    def transactions(self, category=None, start_date=None, end_date=None):
+        snapshot = self.snapshot()
+        table = snapshot.table
+        rows, count = self.positions(snapshot, category, start_date, end_date)
+        return [table[i] for i in islice(rows, count)]
+
+    def positions(self, snapshot, category=None, start_date=None, end_date=None):
+        """Ascending table positions matching the filters, found through the ledgers and date index.
+
+        Returned as (rows, count): only the first count entries of rows belong to the snapshot.
+        """
+        if start_date is not None:
+            rows = sorted(snapshot.date_range(start_date, end_date))
+            if category:
+                table = snapshot.table
+                rows = [i for i in rows if table[i]["category"] == category]
+            return rows, len(rows)
+        if category:
+            # The category's ledger indexes straight into the shared table
+            return snapshot.ledgers.get(category, ([], 0))
+        return range(snapshot.size), snapshot.size
+
+    def store_id(self):
+        return self.snapshot().store_id
+
+    def changes_since(self, seq, store_id=None):
+        """(store id, version, mutations after seq or None if no longer logged, balances, all transactions if None)
+
+        A store_id other than this store's also gets None, its seqs count another history.
+        """
+        snapshot = self.snapshot()
+        changes = snapshot.changes_since(seq) if store_id in (None, snapshot.store_id) else None
+        transactions = snapshot.table[:snapshot.size] if changes is None else None
+        return snapshot.store_id, snapshot.seq, changes, dict(snapshot.balances), transactions
+
+    def summary(self, group, category=None, start=None, end=None):
+        """Totals per period and category from the rollups, built on first use and kept up by the writer"""
+        snapshot = self.snapshot()
+        if snapshot.rollups is None:
+            writer.call(lambda: self.ensure_rollups())
+            snapshot = self.snapshot()
+        rows = []
+        for name, periods in snapshot.rollups[group].items():
+            if category and name != category:
+                continue
+            rows.extend(summary_row(period, name, totals) for period, totals in periods.items()
+                        if (start is None or period >= start) and (end is None or period <= end))
+        rows.sort(key=lambda row: (row["period"], row["category"]))
+        return rows
+
+    def ensure_rollups(self):
+        data = get_data()
+        if data.get("rollups") is None:
+            data["rollups"] = build_rollups(data["transactions"])
+
+    def search(self, words, category=None, start_date=None, end_date=None, limit=50, cursor=None):
+        """Newest-first page of the transactions with a word starting with each of words in their description.
+
+        The index is built on first use and kept up by the writer. Candidates come from the
+        rarest word's postings, or the category's ledger or the date range when that holds fewer
+        rows, newest first, and are checked against the words' postings and the filters until
+        the page is full.
+        """
+        snapshot = self.snapshot()
+        if snapshot.vocab is None:
+            writer.call(lambda: self.ensure_search_index())
+            snapshot = self.snapshot()
+        table = snapshot.table
+        # Ids increase along the table, so the cursor's position is found by bisection
+        end = snapshot.size if cursor is None else bisect_left(table, cursor, 0, snapshot.size, key=lambda t: t["id"])
+        found = sorted((snapshot.word_postings(word, end) for word in words),
+                       key=lambda lists: sum(count for _, count in lists))
+        if not found or not found[0]:
+            return [], None
+        candidates = heapq.merge(*(descending(positions, count) for positions, count in found[0]), reverse=True)
+        checked = found[1:]
+        fewest = sum(count for _, count in found[0])
+        if category:
+            ledger, count = snapshot.ledgers.get(category, ([], 0))
+            count = bisect_left(ledger, end, 0, count)
+            if count < fewest:
+                candidates, checked, fewest = descending(ledger, count), found, count
+        if start_date is not None:
+            lo, hi = snapshot.date_bounds(start_date, end_date)
+            if hi - lo < fewest:
+                rows, count = self.positions(snapshot, category, start_date, end_date)
+                candidates = descending(rows, bisect_left(rows, end, 0, count))
+                checked = found
+        start = start_date.isoformat() if start_date is not None else None
+        end_day = end_date.isoformat() if end_date is not None else None
+        page = []
+        previous = None
+        for position in candidates:
+            if position == previous:
+                continue  # Two of the words starting with the same prefix
+            previous = position
+            t = table[position]
+            if category and t["category"] != category:
+                continue
+            if start is not None and not start <= t["date"][:10] <= end_day:
+                continue
+            if all(any(contains(positions, count, position) for positions, count in lists) for lists in checked):
+                page.append(t)
+                if len(page) > limit:
+                    break
+        return page_with_cursor(page, limit)
+
+    def ensure_search_index(self):
+        data = get_data()
+        if data.get("search_index") is None:
+            data["search_index"] = build_search_index(data["transactions"])
+
+    def column_view(self):
+        """The snapshot's transactions as a ColumnView, extended in place of a rebuild after appends"""
+        snapshot = self.snapshot()
+        table, size = snapshot.table, snapshot.size
+        with column_cache["lock"]:
+            view = column_cache["view"]
+            if view is not None and view.source is table and view.size == size:
+                return view
+            if view is not None and view.source is table and view.size < size:
+                view = view.extended(islice(table, view.size, size))
+            else:
+                # A delete put a new table in place, or this is the first report
+                view = ColumnView(islice(table, size))
+            view.source = table
+            column_cache["view"] = view
+            return view
+
+    def transactions_page(self, category=None, start_date=None, end_date=None, limit=50, cursor=None):
+        snapshot = self.snapshot()
+        table = snapshot.table
+        if start_date is not None:
+            return page_with_cursor(self.dated_page(snapshot, category, start_date, end_date, limit, cursor), limit)
+        rows, count = self.positions(snapshot, category)
+        # Ids increase along the table, so the cursor's position is found by bisection
+        end = count if cursor is None else bisect_left(rows, cursor, 0, count, key=lambda i: table[i]["id"])
+        page = [table[rows[pos]] for pos in range(end - 1, max(end - limit - 2, -1), -1)]
+        return page_with_cursor(page, limit)
+
+    def dated_page(self, snapshot, category, start_date, end_date, limit, cursor):
+        """Up to limit + 1 rows of a date range, newest date first and by id within a date, after cursor.
+
+        The date index is walked back from the cursor, passing over other categories' rows,
+        or a category's own rows are put in that order when that is the smaller job: a walk
+        passes about (hi - lo) / count rows per row kept.
+        """
+        table = snapshot.table
+        after = None
+        if cursor is not None:
+            position = bisect_left(table, cursor, 0, snapshot.size, key=lambda t: t["id"])
+            if position == snapshot.size or table[position]["id"] != cursor:
+                raise BudgetError("Invalid cursor: its transaction no longer exists")
+            after = (date_epoch(table[position]["date"]), position)
+        lo, hi = snapshot.date_bounds(start_date, end_date)
+        ledger, count = snapshot.ledgers.get(category, ([], 0)) if category else (None, 0)
+        if category and count * count < (limit + 1) * (hi - lo):
+            first, last = day_epochs(start_date, end_date)
+            keys = ((date_epoch(table[i]["date"]), i) for i in islice(ledger, count))
+            keys = [key for key in keys if first <= key[0] <= last and (after is None or key < after)]
+            return [table[i] for _, i in heapq.nlargest(limit + 1, keys)]
+        if after is not None:
+            hi = min(hi, snapshot.date_slot(*after))
+        page = []
+        for slot in range(hi - 1, lo - 1, -1):
+            t = table[snapshot.by_date[slot]]
+            if category and t["category"] != category:
+                continue
+            page.append(t)
+            if len(page) > limit:
+                break
+        return page
+
+    def iter_transactions(self, start_date=None, end_date=None, by_date=False):
+        # Bound to the snapshot current when the stream starts, so later writes don't leak in
+        snapshot = self.snapshot()
+        table = snapshot.table
+        if by_date:
+            rows, count = snapshot.by_date, snapshot.indexed
+            if start_date is not None:
+                rows = snapshot.date_range(start_date, end_date)
+                count = len(rows)
+        else:
+            rows, count = self.positions(snapshot, start_date=start_date, end_date=end_date)
+        for i in islice(rows, count):
+            yield table[i]
+
+    def begin(self):
+        # Picks up writes from other processes, the caller holds LOCK_FILE
+        self.batch = (get_data(), [])
+
+    def stage(self, mutations):
+        data, staged = self.batch
+        stage(data, mutations)
+        staged.extend(mutations)
+
+    def finish(self, ok=True):
+        data, staged = self.batch
+        self.batch = None
+        if not ok:
+            data_cache["data"] = None
+            return False
+        return persist(data, staged) if staged else True
+
+    def pending_log_bytes(self):
+        if STORAGE_MODE != "journal" or not os.path.exists(JOURNAL_FILE):
+            return 0
+        return os.path.getsize(JOURNAL_FILE)
+
+    def checkpoint_log(self):
+        """Fold the journal into a new snapshot without holding up the writer while writing it"""
+        with lock_file(CHECKPOINT_LOCK_FILE, blocking=False) as acquired:
+            if not acquired:
+                return False  # another process is already checkpointing
+            # Taken on the writer thread, in step with the journal on disk
+            snapshot, offset, frozen = writer.call(lambda: (Snapshot(get_data()), journal_size, data_stamp()))
+            if not offset:
+                return True
+            # The slow part: writes keep being appended to the journal meanwhile, and records up to
+            # snapshot.seq that are still in the journal are skipped on replay
+            started = time.perf_counter()
+            temp_file = DATA_FILE + ".checkpoint.tmp"
+            try:
+                write_snapshot(snapshot.frozen(), temp_file)
+            except Exception as e:
+                print(f"Error saving data: {str(e)}")
+                return False
+            # Swapped in on the writer thread, so no write or publish sees the new file before
+            # the stamp that says the resident data already matches it
+            if not writer.call(lambda: self.compact_log(offset, temp_file, frozen)):
+                return False
+            metrics.observe("budget_save_data_duration_seconds", time.perf_counter() - started)
+            return True
+
+    def compact_log(self, offset, snapshot_file, frozen):
+        snapshot_stat, journal_stat = data_stamp()
+        if snapshot_stat != frozen[0] or journal_stat is None or journal_stat[0] != frozen[1][0]:
+            # The snapshot or the journal was replaced since the freeze, so the frozen data may
+            # be older than the file and offset may no longer point into the journal
+            print("Data files changed during the checkpoint, skipping it")
+            os.remove(snapshot_file)
+            return False
+        if data_cache["data"] is None or data_stamp() != data_cache["stamp"]:
+            get_data()  # another process wrote meanwhile, resync journal_size
+        os.replace(snapshot_file, DATA_FILE)
+        compact_journal(offset)
+        # The files changed but not what they hold, so the resident data stays valid
+        data_cache["stamp"] = data_stamp()
+        return True
+
+    def check_balances(self):
+        drifted = []
+
+        def repaired():
+            # Compared before load_data's own rebuild, which would hide the drift
+            data = load_data(rebuild=False)
+            drifted.extend(rebuild_balances(data))
+            return data if drifted else None
+
+        return drifted if checkpoint(repaired) else None
+
+class SqliteStore:
+    """Store backed by SQLite in WAL mode, with transactions indexed by (category, date)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS categories (
+            name TEXT PRIMARY KEY,
+            balance REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            amount REAL NOT NULL,
+            description TEXT NOT NULL DEFAULT '',
+            date TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_transactions_category_date ON transactions (category, date);
+        CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date);
+        CREATE INDEX IF NOT EXISTS idx_transactions_category_id ON transactions (category, id);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY,
+            mutation TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rollups (
+            grouping TEXT NOT NULL,
+            category TEXT NOT NULL,
+            period TEXT NOT NULL,
+            deposits REAL NOT NULL,
+            withdrawals REAL NOT NULL,
+            transfers REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (grouping, category, period)
+        );
+    """
+    # Full-text index over the descriptions for GET /api/transactions/search; it holds no copy
+    # of the text, and the triggers keep it in step with every insert and delete
+    SEARCH_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5 (
+            description, content='transactions', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 0', prefix='1 2 3 4'
+        );
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN
+            INSERT INTO transactions_fts (rowid, description) VALUES (new.id, new.description);
+        END;
+        CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN
+            INSERT INTO transactions_fts (transactions_fts, rowid, description) VALUES ('delete', old.id, old.description);
+        END;
+    """
+    COLUMNS = "amount, description, date, type, category, id"
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.checkpointed_at = 0
+        # Cleared when SQLite is built without FTS5, searches then scan the descriptions
+        self.fts = True
+
+    def publish(self):
+        # Readers get their snapshots from SQLite's WAL, one per read transaction
+        pass
+
+    @property
+    def conn(self):
+        # sqlite3 connections can't be shared between threads, so each gets its own
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            created = not os.path.exists(self.path)
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            if CHECKPOINT_SECONDS > 0:
+                # Checkpoints are left to the background checkpointer instead of the committing request
+                conn.execute("PRAGMA wal_autocheckpoint=0")
+            conn.execute(f"PRAGMA journal_size_limit={CHECKPOINT_BYTES}")
+            conn.executescript(self.SCHEMA)
+            # A new id for a new database, even one migrated from JSON: its seqs start over
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('store_id', ?)", (new_store_id(),))
+            self.local.conn = conn
+            if self.fts:
+                try:
+                    conn.executescript(self.SEARCH_SCHEMA)
+                except sqlite3.OperationalError as e:
+                    print(f"Full-text search unavailable, falling back to scans: {str(e)}")
+                    self.fts = False
+            # Before migrating, whose rows the triggers then index as they go in
+            if self.fts and conn.execute("SELECT 1 FROM meta WHERE key = 'search'").fetchone() is None:
+                self.build_search_index(conn)
+            if created and os.path.exists(DATA_FILE):
+                migrate_to_sqlite(self, load_data())
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'rollups'").fetchone() is None:
+                self.build_rollups(conn)
+        return conn
+
+    def build_rollups(self, conn):
+        """Compute the rollups from scratch, for databases from before them or after a bulk load"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'rollups'").fetchone() is None:
+                rollups = build_rollups(conn.execute("SELECT amount, date, type, category FROM transactions"))
+                conn.execute("DELETE FROM rollups")
+                conn.executemany(
+                    "INSERT INTO rollups (grouping, category, period, deposits, withdrawals, transfers, count) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    ((group, name, period, *totals)
+                     for group, categories in rollups["groups"].items()
+                     for name, periods in categories.items()
+                     for period, totals in periods.items())
+                )
+                conn.execute("INSERT INTO meta (key, value) VALUES ('rollups', 1)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def build_search_index(self, conn):
+        """Index the descriptions already stored, for databases from before the full-text index"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'search'").fetchone() is None:
+                conn.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+                conn.execute("INSERT INTO meta (key, value) VALUES ('search', 1)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def version(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+        return row["value"] if row else 0
+
+    def category_names(self):
+        return [row["name"] for row in self.conn.execute("SELECT name FROM categories ORDER BY rowid")]
+
+    def transaction_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+    def has_category(self, name):
+        return self.conn.execute("SELECT 1 FROM categories WHERE name = ?", (name,)).fetchone() is not None
+
+    def balance(self, name):
+        return self.conn.execute("SELECT balance FROM categories WHERE name = ?", (name,)).fetchone()["balance"]
+
+    def balances(self):
+        return {row["name"]: row["balance"] for row in self.conn.execute("SELECT name, balance FROM categories ORDER BY rowid")}
+
+    def where(self, category=None, start_date=None, end_date=None, cursor=None):
+        """Build the WHERE clause and parameters shared by the transaction queries"""
+        clauses, params = [], []
+        if category:
+            clauses.append("category = ?")
+            params.append(category)
+        if start_date is not None:
+            # Dates are stored as 'YYYY-MM-DD HH:MM:SS', so whole days compare as strings
+            clauses.append("date >= ? AND date <= ?")
+            params.extend([start_date.isoformat(), f"{end_date.isoformat()} 23:59:59"])
+        if cursor is not None:
+            clauses.append("id < ?")
+            params.append(cursor)
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def transactions(self, category=None, start_date=None, end_date=None):
+        where, params = self.where(category, start_date, end_date)
+        rows = self.conn.execute(f"SELECT {self.COLUMNS} FROM transactions {where} ORDER BY id", params)
+        return [dict(row) for row in rows]
+
+    def transactions_page(self, category=None, start_date=None, end_date=None, limit=50, cursor=None):
+        conn = self.conn
+        if start_date is None:
+            where, params = self.where(category, cursor=cursor)
+            order = "id DESC"
+        else:
+            # In (date, id) order, as the date indexes hold the rows, so a page never sorts the range
+            where, params = self.where(category, start_date, end_date)
+            order = "date DESC, id DESC"
+            if cursor is not None:
+                row = conn.execute("SELECT date FROM transactions WHERE id = ?", (cursor,)).fetchone()
+                if row is None:
+                    raise BudgetError("Invalid cursor: its transaction no longer exists")
+                where += " AND date <= ? AND (date, id) < (?, ?)"
+                params.extend([row["date"], row["date"], cursor])
+        rows = conn.execute(
+            f"SELECT {self.COLUMNS} FROM transactions {where} ORDER BY {order} LIMIT ?",
+            params + [limit + 1]
+        )
+        return page_with_cursor([dict(row) for row in rows], limit)
+
+    def search(self, words, category=None, start_date=None, end_date=None, limit=50, cursor=None):
+        """Newest-first page of the transactions with a word starting with each of words in their description"""
+        conn = self.conn
+        scan = category and conn.execute(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM transactions WHERE category = ? LIMIT ?)",
+            (category, SEARCH_SCAN_ROWS + 1)
+        ).fetchone()[0] <= SEARCH_SCAN_ROWS
+        if self.fts and not scan:
+            where, params = self.where(category, start_date, end_date)
+            # Words are letters and digits only, so they can be quoted as they are; * makes them prefixes
+            clauses, bounds = ["transactions_fts MATCH ?"], [" ".join(f'"{word}"*' for word in words)]
+            if cursor is not None:
+                clauses.append("f.rowid < ?")
+                bounds.append(cursor)
+            columns = ", ".join(f"t.{column}" for column in self.COLUMNS.split(", "))
+            # One read transaction, so the id bounds hold for the rows searched
+            conn.execute("BEGIN")
+            try:
+                if start_date is not None:
+                    # The matches are walked newest first, through every newer one before the range
+                    lowest, highest, count = conn.execute(
+                        f"SELECT MIN(id), MAX(id), COUNT(*) FROM (SELECT id FROM transactions {where} LIMIT ?)",
+                        params + [SEARCH_NARROW_ROWS + 1]
+                    ).fetchone()
+                    if not count:
+                        return [], None
+                    if count <= SEARCH_NARROW_ROWS:
+                        clauses.append("f.rowid BETWEEN ? AND ?")
+                        bounds.extend([lowest, highest])
+                rows = conn.execute(
+                    f"SELECT {columns} FROM transactions_fts f JOIN transactions t ON t.id = f.rowid "
+                    f"WHERE {' AND '.join(clauses)} {where.replace('WHERE', 'AND', 1)} ORDER BY f.rowid DESC LIMIT ?",
+                    bounds + params + [limit + 1]
+                )
+                return page_with_cursor([dict(row) for row in rows], limit)
+            finally:
+                conn.execute("COMMIT")
+        where, params = self.where(category, start_date, end_date, cursor)
+        page = []
+        for row in conn.execute(f"SELECT {self.COLUMNS} FROM transactions {where} ORDER BY id DESC", params):
+            found = search_tokens(row["description"])
+            if all(any(w.startswith(word) for w in found) for word in words):
+                page.append(dict(row))
+                if len(page) > limit:
+                    break
+        return page_with_cursor(page, limit)
+
+    def store_id(self):
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'store_id'").fetchone()["value"]
+
+    def changes_since(self, seq, store_id=None):
+        """(store id, version, mutations after seq or None if no longer logged, balances, all transactions if None)"""
+        conn = self.conn
+        # One read transaction, so everything comes from the same version
+        conn.execute("BEGIN")
+        try:
+            own_id = self.store_id()
+            version = self.version()
+            oldest = conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+            floor = version if oldest is None else oldest - 1
+            balances = self.balances()
+            if floor <= seq <= version and store_id in (None, own_id):
+                rows = conn.execute("SELECT mutation FROM changes WHERE seq > ? ORDER BY seq", (seq,))
+                return own_id, version, [json.loads(row["mutation"]) for row in rows], balances, None
+            return own_id, version, None, balances, self.transactions()
+        finally:
+            conn.execute("COMMIT")
+
+    def summary(self, group, category=None, start=None, end=None):
+        clauses, params = ["grouping = ?"], [group]
+        if category:
+            clauses.append("category = ?")
+            params.append(category)
+        if start is not None:
+            clauses.append("period >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("period <= ?")
+            params.append(end)
+        rows = self.conn.execute(
+            f"SELECT period, category, deposits, withdrawals, transfers, count FROM rollups "
+            f"WHERE {' AND '.join(clauses)} ORDER BY period, category",
+            params
+        )
+        return [summary_row(row["period"], row["category"], tuple(row)[2:]) for row in rows]
+
+    def column_view(self):
+        """The transactions as a ColumnView, extended with the new rows when none were deleted since"""
+        conn = self.conn
+        with column_cache["lock"]:
+            view = column_cache["view"]
+            conn.execute("BEGIN")
+            try:
+                count, last_id = conn.execute("SELECT COUNT(*), MAX(id) FROM transactions").fetchone()
+                if view is not None and (view.size, view.last_id) == (count, last_id):
+                    return view
+                # Ids only grow, so the cached rows are intact if they are all still there
+                kept = view is not None and conn.execute(
+                    "SELECT COUNT(*) FROM transactions WHERE id <= ?", (view.last_id or 0,)
+                ).fetchone()[0] == view.size
+                select = f"SELECT {self.COLUMNS} FROM transactions"
+                if kept:
+                    view = view.extended(map(dict, conn.execute(f"{select} WHERE id > ? ORDER BY id", (view.last_id or 0,))))
+                else:
+                    view = ColumnView(map(dict, conn.execute(f"{select} ORDER BY id")))
+            finally:
+                conn.execute("COMMIT")
+            column_cache["view"] = view
+            return view
+
+    def iter_transactions(self, start_date=None, end_date=None, by_date=False):
+        where, params = self.where(start_date=start_date, end_date=end_date)
+        order = "date, id" if by_date else "id"
+        self.conn  # Creates and migrates the database on first use
+        # Rows are pulled from the cursor as the caller consumes them, through a connection of
+        # the stream's own: it reads one snapshot and may be resumed from any thread, one at a time
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute(f"SELECT {self.COLUMNS} FROM transactions {where} ORDER BY {order}", params):
+                yield dict(row)
+        finally:
+            conn.close()
+
+    def apply_mutation(self, conn, mutation):
+        """Apply a single mutation record inside the current SQL transaction"""
+        op = mutation["op"]
+        if op == "add_category":
+            conn.execute("INSERT INTO categories (name) VALUES (?)", (mutation["name"],))
+        elif op == "add_transactions":
+            for t in mutation["transactions"]:
+                cursor = conn.execute(
+                    f"INSERT INTO transactions ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                    (t["amount"], t["description"], t["date"], t["type"], t["category"], t.get("id"))
+                )
+                t["id"] = cursor.lastrowid
+                conn.execute("UPDATE categories SET balance = balance + ? WHERE name = ?", (t["amount"], t["category"]))
+        elif op == "delete_category":
+            conn.execute("DELETE FROM transactions WHERE category = ?", (mutation["name"],))
+            conn.execute("DELETE FROM categories WHERE name = ?", (mutation["name"],))
+        else:
+            raise ValueError(f"Unknown journal operation: {op}")
+
+    def commit(self, mutations):
+        """Apply mutations in one transaction as a bulk load: out of the change log, rollups rebuilt afterwards"""
+        try:
+            self.begin()
+            self.stage(mutations, bulk=True)
+            self.conn.execute("DELETE FROM meta WHERE key = 'rollups'")
+        except Exception as e:
+            print(f"Error saving data: {str(e)}")
+            return self.finish(False)
+        return self.finish()
+
+    def begin(self):
+        # BEGIN IMMEDIATE takes SQLite's write lock, which also covers other processes
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+        self.local.seq = row["value"] if row else 0
+
+    def stage(self, mutations, bulk=False):
+        for mutation in mutations:
+            self.local.seq += 1
+            mutation["seq"] = self.local.seq
+            self.apply_mutation(self.conn, mutation)
+            if not bulk:
+                self.update_rollups(self.conn, mutation)
+                # Logged after applying, so new transactions carry their ids
+                self.conn.execute("INSERT INTO changes (seq, mutation) VALUES (?, ?)", (mutation["seq"], json.dumps(mutation)))
+
+    def update_rollups(self, conn, mutation):
+        if mutation["op"] == "add_transactions":
+            conn.executemany(
+                "INSERT INTO rollups (grouping, category, period, deposits, withdrawals, transfers, count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (grouping, category, period) DO UPDATE SET "
+                "deposits = deposits + excluded.deposits, withdrawals = withdrawals + excluded.withdrawals, "
+                "transfers = transfers + excluded.transfers, count = count + excluded.count",
+                ((group, t["category"], period, *rollup_amounts(t))
+                 for t in mutation["transactions"]
+                 for group, period in zip(ROLLUP_GROUPS, rollup_periods(t["date"])))
+            )
+        elif mutation["op"] == "delete_category":
+            conn.execute("DELETE FROM rollups WHERE category = ?", (mutation["name"],))
+
+    def finish(self, ok=True):
+        conn = self.conn
+        if not ok:
+            conn.execute("ROLLBACK")
+            return False
+        try:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seq', ?)", (self.local.seq,))
+            conn.execute("DELETE FROM changes WHERE seq <= ?", (self.local.seq - CHANGES_KEPT,))
+            # With synchronous=FULL the commit is where SQLite syncs the WAL
+            with metrics.timer("budget_fsync_duration_seconds", file="sqlite"):
+                conn.execute("COMMIT")
+            return True
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"Error saving data: {str(e)}")
+            return False
+
+    def pending_log_bytes(self):
+        try:
+            st = os.stat(self.path + "-wal")
+        except FileNotFoundError:
+            return 0
+        return st.st_size if st.st_mtime_ns > self.checkpointed_at else 0
+
+    def checkpoint_log(self):
+        """Copy the WAL back into the database; PASSIVE never waits on readers or writers"""
+        self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        try:
+            self.checkpointed_at = os.stat(self.path + "-wal").st_mtime_ns
+        except FileNotFoundError:
+            pass
+        return True
+
+    def check_balances(self):
+        def repair():
+            conn = self.conn
+            totals = "SELECT COALESCE(SUM(amount), 0) FROM transactions t WHERE t.category = c.name"
+            drifted = [row["name"] for row in conn.execute(f"SELECT name FROM categories c WHERE balance != ({totals})")]
+            if drifted:
+                conn.execute(f"UPDATE categories AS c SET balance = ({totals})")
+            return drifted
+
+        return writer.call(repair)
+
+def descending(positions, count):
+    """The first count entries of positions, last first"""
+    for i in range(count - 1, -1, -1):
+        yield positions[i]
+
+def contains(positions, count, position):
+    """Whether the first count entries of the ascending positions include position"""
+    i = bisect_left(positions, position, 0, count)
+    return i < count and positions[i] == position
+
+def page_with_cursor(rows, limit):
+    """Trim a newest-first page fetched with one extra row, returning it with the next cursor"""
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]["id"]
+    return rows, None
+
+def migrate_to_sqlite(sqlite_store, data):
+    """Copy JSON-format data into an SQLite store in a single transaction"""
+    mutations = [{"op": "add_category", "name": name} for name in data["categories"]]
+    transactions = [t for t in data["transactions"] if t["category"] in data["categories"]]
+    mutations.append({"op": "add_transactions", "transactions": transactions})
+    if sqlite_store.commit(mutations):
+        print(f"Migrated {len(mutations) - 1} categories and {len(transactions)} transactions to SQLite")
+        return True
+    return False
+
+store = SqliteStore(SQLITE_FILE) if STORAGE_MODE == "sqlite" else JsonStore()
+
+@contextmanager
+def lock_file(path, blocking=True):
+    """Exclusive flock on path, yielding whether it was acquired (always True when blocking)"""
+    if fcntl is None:
+        yield True
+        return
+    with open(path, 'a') as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class BudgetError(Exception):
+    """A write that can't be applied, reported to the client as a JSON error"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+    def to_response(self):
+        return jsonify({"status": "error", "message": self.message, **self.details}), self.status
+
+@app.errorhandler(BudgetError)
+def budget_error(e):
+    # Raised outside a route's own handling, e.g. by @versioned while the data can't be loaded
+    return e.to_response()
+
+def change_events(mutations, balances):
+    """Compact change events for committed mutations, with the new balances of the categories they touch"""
+    events = []
+    for mutation in mutations:
+        op = mutation["op"]
+        if op == "add_category":
+            events.append({"type": "category_added", "seq": mutation["seq"], "name": mutation["name"], "balance": 0})
+        elif op == "delete_category":
+            events.append({"type": "category_deleted", "seq": mutation["seq"], "name": mutation["name"]})
+        elif op == "add_transactions":
+            transactions = mutation["transactions"]
+            is_transfer = bool(transactions) and all(t["type"] in ("transfer_in", "transfer_out") for t in transactions)
+            touched = dict.fromkeys(t["category"] for t in transactions)
+            events.append({
+                "type": "transfer" if is_transfer else "transactions_added",
+                "seq": mutation["seq"],
+                "transactions": transactions,
+                "balances": {name: balances[name] for name in touched if name in balances}
+            })
+    return events
+
+class ChangeFeed:
+    """The latest change events, numbered by data version, for /api/events subscribers.
+
+    Changes this process didn't commit itself (another process's writes, a reload) show up
+    as a single "reset" event, telling subscribers to refetch instead of applying deltas.
+    """
+
+    def __init__(self, size):
+        self.events = deque(maxlen=size)
+        self.last = None
+        self.changed = threading.Condition()
+        self.listeners = set()
+
+    def position(self):
+        with self.changed:
+            return self.last or 0
+
+    def append(self, events):
+        if not events:
+            return
+        with self.changed:
+            if self.last is not None and events[0]["seq"] != self.last + 1:
+                # Someone else wrote in between, the deltas alone would leave subscribers behind
+                events = [{"type": "reset", "seq": events[-1]["seq"]}]
+            self.events.extend(events)
+            self.last = events[-1]["seq"]
+            self.changed.notify_all()
+        for listener in list(self.listeners):
+            try:
+                listener()
+            except Exception as e:
+                print(f"Error in change listener: {str(e)}")
+
+    def sync(self, seq):
+        """Note the store's version after a refresh"""
+        with self.changed:
+            if self.last is None:
+                self.last = seq
+                return
+            if seq == self.last:
+                return
+        self.append([{"type": "reset", "seq": seq}])
+
+    def since(self, seq):
+        """Events after seq, or None when some of them are no longer kept"""
+        with self.changed:
+            last = self.last or 0
+            if seq == last:
+                return []
+            if seq > last or not self.events or self.events[0]["seq"] > seq + 1:
+                return None
+            return [event for event in self.events if event["seq"] > seq]
+
+    def wait(self, seq, timeout):
+        """Like since(seq), but waits up to timeout seconds for events when there are none yet"""
+        with self.changed:
+            self.changed.wait_for(lambda: (self.last or 0) != seq, timeout)
+            return self.since(seq)
+
+change_feed = ChangeFeed(EVENTS_BACKLOG)
+
+class Writer:
+    """The one thread that changes the data, fed through a queue.
+
+    Writers hand in a plan: a function that validates against the store and returns the
+    mutations to apply. The writer thread takes everything queued (after waiting
+    WRITE_BATCH_WINDOW for more to arrive), runs the plans in order against the same state
+    under the cross-process lock and persists the lot with one commit. It then publishes the
+    result for readers and the change feed before reporting back, so a writer always reads
+    its own writes. While idle it looks for writes from other processes every refresh seconds.
+    """
+
+    def __init__(self, store, lock_path=None, window=0, refresh=None, feed=None):
+        self.store = store
+        self.lock_path = lock_path
+        self.window = window
+        self.refresh = refresh
+        self.feed = feed
+        self.queue = queue.Queue()
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.started = threading.Event()
+
+    def start(self):
+        """Start the writer thread if needed, returning once it has published the data"""
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="writer", daemon=True)
+                self.thread.start()
+        if threading.current_thread() is not self.thread:
+            self.started.wait()
+
+    @contextmanager
+    def file_lock(self):
+        if self.lock_path is None:
+            yield
+            return
+        with lock_file(self.lock_path):
+            yield
+
+    def enqueue(self, plan, callback):
+        """Queue plan(store) for the next batch.
+
+        callback(request) runs on the writer thread once request["result"] (the mutations,
+        durable and published) or request["error"] is set.
+        """
+        request = {"plan": plan, "callback": callback, "result": None, "error": None}
+        self.start()
+        self.queue.put(request)
+        return request
+
+    def submit(self, plan):
+        """Run plan(store) inside a batch and return its mutations once they are durable"""
+        done = threading.Event()
+        request = self.enqueue(plan, lambda request: done.set())
+        done.wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["result"]
+
+    def call(self, function):
+        """Run function() on the writer thread between batches, holding the write lock"""
+        done = threading.Event()
+        request = {"call": function, "callback": lambda request: done.set(), "result": None, "error": None}
+        self.start()
+        self.queue.put(request)
+        done.wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["result"]
+
+    def run(self):
+        self.publish()
+        self.started.set()
+        while True:
+            try:
+                first = self.queue.get(timeout=self.refresh)
+            except queue.Empty:
+                self.publish()
+                continue
+            if self.window and "plan" in first:
+                # Give concurrent writers a moment to join this batch
+                time.sleep(self.window)
+            requests = [first]
+            while True:
+                try:
+                    requests.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = []
+            for request in requests:
+                if "call" in request:
+                    self.commit_batch(batch)
+                    batch = []
+                    self.run_call(request)
+                else:
+                    batch.append(request)
+            self.commit_batch(batch)
+
+    def publish(self, committed=()):
+        """Publish the data for readers, and the committed mutations (if any) as change events"""
+        try:
+            self.store.publish()
+            if self.feed is None:
+                return
+            if committed:
+                self.feed.append(change_events(committed, self.store.balances()))
+            else:
+                self.feed.sync(self.store.version())
+        except Exception as e:
+            print(f"Error publishing data: {str(e)}")
+
+    def notify(self, request):
+        try:
+            request["callback"](request)
+        except Exception as e:
+            print(f"Error in write callback: {str(e)}")
+
+    def run_call(self, request):
+        try:
+            with self.file_lock():
+                request["result"] = request["call"]()
+        except Exception as e:
+            request["error"] = e
+        self.publish()
+        self.notify(request)
+
+    def commit_batch(self, batch):
+        if not batch:
+            return
+        staged = []
+        try:
+            with self.file_lock():
+                self.store.begin()
+                ok = True
+                for request in batch:
+                    try:
+                        mutations = request["plan"](self.store)
+                    except Exception as e:
+                        request["error"] = e
+                        continue
+                    try:
+                        self.store.stage(mutations)
+                    except Exception as e:
+                        # A half-applied plan taints the whole batch
+                        print(f"Error applying mutations: {str(e)}")
+                        ok = False
+                        break
+                    request["result"] = mutations
+                    staged.append(request)
+                if not self.store.finish(ok):
+                    for request in staged:
+                        request["error"] = BudgetError("Failed to save data", 500)
+        except Exception as e:
+            print(f"Error committing writes: {str(e)}")
+            for request in batch:
+                if request["error"] is None:
+                    request["error"] = e if isinstance(e, BudgetError) else BudgetError("Failed to save data", 500)
+        finally:
+            self.publish([mutation for request in staged if request["error"] is None for mutation in request["result"]])
+            for request in batch:
+                if request["error"] is None and request["result"] is None:
+                    request["error"] = BudgetError("Failed to save data", 500)
+                self.notify(request)
+
+writer = Writer(
+    store,
+    None if STORAGE_MODE == "sqlite" else LOCK_FILE,
+    WRITE_BATCH_WINDOW,
+    REFRESH_INTERVAL,
+    change_feed
+)
+
+class Checkpointer(threading.Thread):
+    """Background thread that folds the store's log into its main file, off the request path"""
+
+    def __init__(self, store, max_bytes, max_seconds, poll=1.0):
+        super().__init__(name="checkpointer", daemon=True)
+        self.store = store
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.poll = poll
+
+    def run(self):
+        last = time.monotonic()
+        while True:
+            time.sleep(self.poll)
+            try:
+                pending = self.store.pending_log_bytes()
+                if pending and (pending >= self.max_bytes or time.monotonic() - last >= self.max_seconds):
+                    with metrics.timer("budget_checkpoint_duration_seconds"):
+                        done = self.store.checkpoint_log()
+                    if done:
+                        last = time.monotonic()
+            except Exception as e:
+                print(f"Checkpoint failed: {str(e)}")
+
+checkpointer = Checkpointer(store, CHECKPOINT_BYTES, CHECKPOINT_SECONDS)
+if STORAGE_MODE in ("journal", "sqlite") and CHECKPOINT_SECONDS > 0:
+    checkpointer.start()
+
+def plan_add_category(store, category_name):
+    """Validate a new category against the store, returning the mutation that adds it"""
+    if not category_name:
+        raise BudgetError("Category name required")
+    if store.has_category(category_name):
+        raise BudgetError("Category already exists")
+    return [{"op": "add_category", "name": category_name}]
+
+def build_transaction(category_name, amount, description, transaction_type, date=None):
+    """Validate the fields of a deposit or withdrawal, returning the transaction record"""
+    if transaction_type not in ("deposit", "withdraw"):
+        raise BudgetError("Invalid transaction type")
+    # float() takes "nan" and "inf", which no comparison below would catch
+    if not math.isfinite(amount):
+        raise BudgetError("Invalid amount")
+    if amount <= 0:
+        raise BudgetError("Amount must be positive")
+    return {
+        "amount": amount if transaction_type == "deposit" else -amount,
+        "description": description,
+        "date": date or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "type": transaction_type,
+        "category": category_name
+    }
+
+def plan_add_transaction(store, category_name, amount, description, transaction_type):
+    """Validate a deposit or withdrawal against the store, returning the mutation that records it"""
+    if not store.has_category(category_name):
+        raise BudgetError("Invalid category")
+    transaction = build_transaction(category_name, amount, description, transaction_type)
+    current_balance = store.balance(category_name)
+    if transaction_type == "withdraw" and amount > current_balance:
+        raise BudgetError("Insufficient funds", current_balance=current_balance)
+    return [{"op": "add_transactions", "transactions": [transaction]}]
+
+def parse_import_row(row):
+    """Turn one imported row (category, amount, type, description, date) into a transaction.
+
+    type may be left out, in which case a negative amount is a withdrawal.
+    """
+    row = {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+    try:
+        amount = float(row.get("amount") or 0)
+    except (TypeError, ValueError):
+        raise BudgetError("Invalid amount")
+    transaction_type = (row.get("type") or "").strip().lower() or ("withdraw" if amount < 0 else "deposit")
+    date = (row.get("date") or "").strip()
+    if date:
+        try:
+            date = datetime.fromisoformat(date).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            raise BudgetError("Invalid date")
+    return build_transaction(
+        (row.get("category") or "").strip(),
+        abs(amount),
+        (row.get("description") or "").strip(),
+        transaction_type,
+        date
+    )
+
+def plan_import(store, rows, errors):
+    """Validate imported rows in order against running balances.
+
+    Rows that fail are reported in errors and skipped, the rest become one mutation.
+    """
+    balances = {}
+    transactions = []
+    for number, row in enumerate(rows, 1):
+        try:
+            if not isinstance(row, dict):
+                raise BudgetError("Row must be an object")
+            transaction = parse_import_row(row)
+            category_name = transaction["category"]
+            if category_name not in balances:
+                if not store.has_category(category_name):
+                    raise BudgetError("Invalid category")
+                balances[category_name] = store.balance(category_name)
+            if balances[category_name] + transaction["amount"] < 0:
+                raise BudgetError("Insufficient funds", current_balance=balances[category_name])
+            balances[category_name] += transaction["amount"]
+            transactions.append(transaction)
+        except BudgetError as e:
+            errors.append({"row": number, "message": e.message, **e.details})
+    return [{"op": "add_transactions", "transactions": transactions}] if transactions else []
+
+def read_import_rows(text, is_json):
+    """Parse a bulk import body: a JSON array (or {"transactions": [...]}) or CSV with a header row"""
+    if is_json:
+        rows = json.loads(text)
+        if isinstance(rows, dict):
+            rows = rows.get("transactions")
+        if not isinstance(rows, list):
+            raise BudgetError("Expected a JSON array of transactions")
+        return rows
+    return list(csv.DictReader(StringIO(text)))
+
+def import_transactions(rows):
+    """Apply imported rows in a single commit, returning (imported transactions, row errors)"""
+    errors = []
+    mutations = writer.submit(lambda store: plan_import(store, rows, errors))
+    imported = mutations[0]["transactions"] if mutations else []
+    return imported, errors
+
+def plan_transfer(store, from_cat, to_cat, amount):
+    """Validate a transfer against the store, returning one mutation holding both legs"""
+    if not store.has_category(from_cat) or not store.has_category(to_cat):
+        raise BudgetError("Invalid categories")
+    if not math.isfinite(amount):
+        raise BudgetError("Invalid amount")
+    if amount <= 0:
+        raise BudgetError("Amount must be positive")
+    from_balance = store.balance(from_cat)
+    if amount > from_balance:
+        raise BudgetError("Insufficient funds", current_balance=from_balance)
+    date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    withdraw_transaction = {
+        "amount": -amount,
+        "description": f"Transfer to {to_cat}",
+        "date": date,
+        "type": "transfer_out",
+        "category": from_cat
+    }
+    deposit_transaction = {
+        "amount": amount,
+        "description": f"Transfer from {from_cat}",
+        "date": date,
+        "type": "transfer_in",
+        "category": to_cat
+    }
+    # Both legs go into one mutation so a transfer is never half-applied
+    return [{"op": "add_transactions", "transactions": [withdraw_transaction, deposit_transaction]}]
+
+def plan_delete_category(store, category_name):
+    """Check the category exists, returning the mutation that deletes it with its transactions"""
+    if not store.has_category(category_name):
+        raise BudgetError("Category not found", 404)
+    return [{"op": "delete_category", "name": category_name}]
+
+class PendingStore:
+    """The store as it will be once the mutations planned so far are applied, so each plan of a batch sees the ones before it"""
+
+    def __init__(self, store):
+        self.store = store
+        # Category name -> balance after the pending mutations, or None once deleted
+        self.categories = {}
+
+    def apply(self, mutations):
+        for mutation in mutations:
+            if mutation["op"] == "add_category":
+                self.categories[mutation["name"]] = 0
+            elif mutation["op"] == "delete_category":
+                self.categories[mutation["name"]] = None
+            elif mutation["op"] == "add_transactions":
+                for t in mutation["transactions"]:
+                    self.categories[t["category"]] = self.balance(t["category"]) + t["amount"]
+
+    def has_category(self, name):
+        if name in self.categories:
+            return self.categories[name] is not None
+        return self.store.has_category(name)
+
+    def balance(self, name):
+        if name in self.categories:
+            return self.categories[name]
+        return self.store.balance(name)
+
+def plan_operation(store, operation):
+    """Plan one operation of a batch, given with the same fields as the body of its own route"""
+    if not isinstance(operation, dict):
+        raise BudgetError("Operation must be an object")
+    op = operation.get("op")
+    if op in ("add_transaction", "transfer"):
+        try:
+            amount = float(operation.get("amount", 0))
+        except (TypeError, ValueError):
+            raise BudgetError("Invalid amount")
+    if op == "add_category":
+        return plan_add_category(store, str(operation.get("name") or "").strip())
+    if op == "add_transaction":
+        description = str(operation.get("description") or "").strip()
+        return plan_add_transaction(store, operation.get("category"), amount, description, operation.get("type"))
+    if op == "transfer":
+        return plan_transfer(store, operation.get("from_category"), operation.get("to_category"), amount)
+    if op == "delete_category":
+        return plan_delete_category(store, operation.get("name"))
+    raise BudgetError(f"Unknown operation: {op}")
+
+def plan_batch(store, operations, steps):
+    """Plan operations in order, each against the state the ones before it leave, as one all-or-nothing write.
+
+    The first operation to fail fails the batch, reported by its number; otherwise steps
+    gets each operation's mutations.
+    """
+    pending = PendingStore(store)
+    for number, operation in enumerate(operations, 1):
+        try:
+            mutations = plan_operation(pending, operation)
+        except BudgetError as e:
+            raise BudgetError(e.message, e.status, operation=number, **e.details)
+        pending.apply(mutations)
+        steps.append(mutations)
+    return [mutation for mutations in steps for mutation in mutations]
+
+def read_batch(body):
+    """The operations of a POST /api/batch body: {"operations": [...]} or the bare array"""
+    operations = body.get("operations") if isinstance(body, dict) else body
+    if not isinstance(operations, list) or not operations:
+        raise BudgetError("Expected a non-empty list of operations")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise BudgetError(f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+    return operations
+
+def batch_response(operations, steps, balances):
+    """Response body for a committed batch: per operation its seq and any transactions it added"""
+    results = []
+    for operation, mutations in zip(operations, steps):
+        result = {"op": operation["op"], "seq": mutations[-1]["seq"]}
+        transactions = [t for mutation in mutations if mutation["op"] == "add_transactions" for t in mutation["transactions"]]
+        if transactions:
+            result["transactions"] = transactions
+        results.append(result)
+    return {
+        "status": "success",
+        "message": f"Applied {len(results)} operations",
+        "results": results,
+        "balances": balances
+    }
+
+@app.cli.command("check-balances")
+def check_balances_command():
+    """Verify the stored running balances against the ledgers and fix any drift"""
+    # Not on the writer: the JSON store takes the checkpoint lock before the write lock
+    drifted = store.check_balances()
+    if drifted == []:
+        print("All balances consistent")
+    elif drifted:
+        print(f"Repaired balances for: {', '.join(drifted)}")
+
+@app.cli.command("convert-snapshot")
+@click.argument("snapshot_format", type=click.Choice(["json", "binary"]))
+def convert_snapshot_command(snapshot_format):
+    """Rewrite budget_data.json (folding in its journal) as JSON or the compact binary format"""
+    if checkpoint(load_data, snapshot_format):
+        print(f"Snapshot written as {snapshot_format} ({os.path.getsize(DATA_FILE)} bytes)")
+
+@app.cli.command("migrate-sqlite")
+def migrate_sqlite_command():
+    """One-shot copy of budget_data.json (and its journal) into budget_data.db"""
+    if os.path.exists(SQLITE_FILE):
+        print(f"{SQLITE_FILE} already exists, not migrating")
+        return
+    # Opening the connection on a fresh database performs the migration
+    SqliteStore(SQLITE_FILE).conn
+
+def trusted_caller():
+    """Whether the caller may trigger profiling or read profiles"""
+    # Not trusting loopback callers instead: behind a local reverse proxy that is everyone
+    if not PROFILE_TOKEN:
+        return False
+    supplied = request.headers.get(PROFILE_HEADER) or request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return hmac.compare_digest(supplied.encode(), PROFILE_TOKEN.encode())
+
+def save_profile(profiler, method, route, elapsed):
+    """Write a profile into PROFILE_DIR, then drop the oldest ones beyond PROFILE_LIMIT.
+
+    Names carry the metadata the listing shows: time_method_route_milliseconds.prof
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = "".join(c if c.isalnum() else "-" for c in route).strip("-") or "root"
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{method}_{slug}_{round(elapsed * 1000)}ms.prof"
+    temp_file = os.path.join(PROFILE_DIR, name + ".tmp")
+    profiler.dump_stats(temp_file)
+    os.replace(temp_file, os.path.join(PROFILE_DIR, name))
+    for stale in list_profiles()[PROFILE_LIMIT:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, stale["name"]))
+        except FileNotFoundError:
+            pass  # Another process trimmed it first
+
+def list_profiles():
+    """Saved profiles, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        parts = name[:-len(".prof")].split("_")
+        if not name.endswith(".prof") or len(parts) != 4:
+            continue
+        profiles.append({
+            "name": name,
+            "created": datetime.strptime(parts[0], "%Y%m%d-%H%M%S-%f").strftime("%Y-%m-%d %H:%M:%S"),
+            "method": parts[1],
+            "route": parts[2],
+            "duration_ms": int(parts[3].removesuffix("ms"))
+        })
+    return profiles
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILE_ALL or (PROFILE_HEADER in request.headers and trusted_caller()):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return  # Python 3.12+ allows one active profiler at a time; this request goes unprofiled
+        g.profiler = profiler
+        g.profile_forced = not PROFILE_ALL
+
+@app.after_request
+def note_response_status(response):
+    g.response_status = response.status_code
+    # Bodies from stream_with_context tear the request down a second time once fully sent
+    g.streaming_body = isinstance(response.response, GeneratorType)
+    return response
+
+@app.teardown_request
+def record_request_metrics(error=None):
+    """Count and time the request, for streamed bodies once the last chunk has been sent,
+    and keep its profile if one was taken and the request was slow (or asked for it)"""
+    if g.pop("streaming_body", False):
+        return
+    # Popped so the request is only counted once
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    # The rule, not the path, so /api/categories/<category_name> stays one series
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.inc("budget_http_requests_total", method=request.method, route=route, status=str(g.get("response_status", 500)))
+    elapsed = time.perf_counter() - started
+    metrics.observe("budget_http_request_duration_seconds", elapsed, method=request.method, route=route)
+
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        if g.get("profile_forced") or elapsed * 1000 >= PROFILE_THRESHOLD_MS:
+            try:
+                save_profile(profiler, request.method, route, elapsed)
+            except OSError as e:
+                print(f"Error saving profile: {str(e)}")
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Request, storage and data-size metrics in the Prometheus text format"""
+    gauges = [
+        ("budget_transactions", {}, store.transaction_count()),
+        ("budget_categories", {}, len(store.category_names())),
+        ("budget_data_version", {}, store.version()),
+        ("budget_report_cache_entries", {}, len(report_cache.entries)),
+        ("budget_report_cache_bytes", {}, report_cache.size)
+    ]
+    files = {"data": DATA_FILE, "journal": JOURNAL_FILE, "sqlite": SQLITE_FILE, "sqlite_wal": SQLITE_FILE + "-wal"}
+    for name, path in files.items():
+        if os.path.exists(path):
+            gauges.append(("budget_file_bytes", {"file": name}, os.path.getsize(path)))
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+@app.route('/admin/profiles', methods=['GET'])
+def get_profiles():
+    """List the saved request profiles, newest first"""
+    if not trusted_caller():
+        return jsonify({"status": "error", "message": "Forbidden"}), 403
+    return jsonify({"status": "success", "profiles": list_profiles()})
+
+@app.route('/admin/profiles/<name>', methods=['GET'])
+def get_profile(name):
+    """One profile as pstats text (?sort=cumulative|tottime&limit=N), or the raw file with ?format=raw"""
+    if not trusted_caller():
+        return jsonify({"status": "error", "message": "Forbidden"}), 403
+    if name not in {p["name"] for p in list_profiles()}:
+        return jsonify({"status": "error", "message": "Profile not found"}), 404
+    path = os.path.join(PROFILE_DIR, name)
+    if request.args.get("format") == "raw":
+        return send_file(path, mimetype="application/octet-stream", as_attachment=True, download_name=name)
+    sort = request.args.get("sort", "cumulative")
+    if sort not in ("cumulative", "tottime", "calls"):
+        return jsonify({"status": "error", "message": "sort must be cumulative, tottime or calls"}), 400
+    try:
+        limit = int(request.args.get("limit", "40"))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid limit"}), 400
+    out = StringIO()
+    pstats.Stats(path, stream=out).sort_stats(sort).print_stats(limit)
+    return Response(out.getvalue(), mimetype="text/plain")
 
 @app.route('/')
 def index():
@@ -81,115 +2397,268 @@ def index():
 def serve_js():
     return send_file('static/js/script.js')
 
+def version_tag():
+    """The data version as an ETag value, with the store id so equal seqs of two stores differ"""
+    return f"{store.store_id():x}-v{store.version()}"
+
+def versioned(view):
+    """Tag responses with the data version as a strong ETag and answer If-None-Match with 304"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Read before building the body: if a write lands in between, the tag is older than the
+        # body and the client just refetches once more, never the other way round
+        etag = version_tag()
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # Let browsers keep the body but revalidate on every fetch
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
 @app.route('/api/categories', methods=['GET'])
+@versioned
 def get_categories():
     """Get all categories with their current balance"""
-    data = load_data()
     categories = [{
         "name": name,
-        "balance": calculate_balance(category)
-    } for name, category in data["categories"].items()]
+        "balance": balance
+    } for name, balance in store.balances().items()]
     return jsonify({"status": "success", "categories": categories})
 
 @app.route('/api/categories', methods=['POST'])
 def add_category():
     """Add a new category"""
     try:
-        data = load_data()
         category_name = request.json.get("name", "").strip()
         
-        if not category_name:
-            return jsonify({"status": "error", "message": "Category name required"}), 400
-            
-        if category_name in data["categories"]:
-            return jsonify({"status": "error", "message": "Category already exists"}), 400
-            
-        data["categories"][category_name] = {"ledger": []}
-        
-        if save_data(data):
-            return jsonify({
-                "status": "success",
-                "message": "Category added",
-                "category": {
-                    "name": category_name,
-                    "balance": 0
-                }
-            })
-        return jsonify({"status": "error", "message": "Failed to save data"}), 500
+        writer.submit(lambda store: plan_add_category(store, category_name))
+        return jsonify({
+            "status": "success",
+            "message": "Category added",
+            "category": {
+                "name": category_name,
+                "balance": 0
+            }
+        })
             
+    except BudgetError as e:
+        return e.to_response()
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/transactions', methods=['GET'])
+@versioned
 def get_transactions():
-    """Get transactions, optionally filtered by category"""
+    """Get transactions, optionally filtered by category and date.
+
+    With ?limit=N the newest N are returned along with a next_cursor to pass back
+    as ?cursor= for the following page; pages of a date range run newest date first.
+    ?fields=a,b restricts the keys returned.
+    """
     try:
-        data = load_data()
-        category_filter = request.args.get("category")
-        
-        if category_filter and category_filter != "All Categories":
-            transactions = [t for t in data["transactions"] if t["category"] == category_filter]
-        else:
-            transactions = data["transactions"]
-            
-        return jsonify({
-            "status": "success",
-            "transactions": transactions,
-            "categories": list(data["categories"].keys())  # Include available categories
-        })
+        return jsonify(query_transactions(request.args))
+    except BudgetError as e:
+        return e.to_response()
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+def query_transactions(args):
+    """Response body for GET /api/transactions given its query parameters (a dict-like args)"""
+    category_filter = args.get("category")
+    if not category_filter or category_filter in ("All", "All Categories"):
+        category_filter = None
+
+    try:
+        start_date, end_date = date_filter(args)
+
+        limit = args.get("limit")
+        cursor = args.get("cursor")
+        if limit is not None:
+            limit = int(limit)
+            cursor = int(cursor) if cursor else None
+    except ValueError:
+        raise BudgetError("Invalid limit, cursor or date")
+
+    fields = args.get("fields")
+    if fields:
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in fields if f not in TRANSACTION_FIELDS]
+        if unknown:
+            raise BudgetError(f"Unknown fields: {', '.join(unknown)}")
+
+    if limit is not None:
+        if limit <= 0 or limit > MAX_PAGE_SIZE:
+            raise BudgetError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        transactions, next_cursor = store.transactions_page(category_filter, start_date, end_date, limit, cursor)
+    else:
+        transactions, next_cursor = store.transactions(category_filter, start_date, end_date), None
+
+    if fields:
+        transactions = [{f: t[f] for f in fields} for t in transactions]
+
+    response = {
+        "status": "success",
+        "transactions": transactions,
+        "categories": store.category_names()  # Include available categories
+    }
+    if limit is not None:
+        response["next_cursor"] = next_cursor
+    return response
+
+def date_filter(args):
+    """(start, end) dates from the start and end parameters, open-ended if one is missing, or (None, None)"""
+    start_date = args.get("start")
+    end_date = args.get("end")
+    if not start_date and not end_date:
+        return None, None
+    start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else datetime.min.date()
+    end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else datetime.max.date()
+    return start_date, end_date
+
+@app.route('/api/transactions/search', methods=['GET'])
+@versioned
+def search_transactions():
+    """Find transactions by words in their description (?q=...), newest first and paged like ?limit="""
+    try:
+        return jsonify(query_search(request.args))
+    except BudgetError as e:
+        return e.to_response()
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def query_search(args):
+    """Response body for GET /api/transactions/search.
+
+    Every word of q must start a word of the description, ignoring case, so "tea pl" finds
+    "Tea plucking pay". category, start and end filter as on GET /api/transactions; limit
+    (default 50) and cursor page the matches.
+    """
+    words = search_tokens(args.get("q", ""))
+    if not words:
+        raise BudgetError("q must contain at least one word")
+    category_filter = args.get("category")
+    if not category_filter or category_filter in ("All", "All Categories"):
+        category_filter = None
+    try:
+        start_date, end_date = date_filter(args)
+        limit = int(args.get("limit") or 50)
+        cursor = int(args["cursor"]) if args.get("cursor") else None
+    except ValueError:
+        raise BudgetError("Invalid limit, cursor or date")
+    if limit <= 0 or limit > MAX_PAGE_SIZE:
+        raise BudgetError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    transactions, next_cursor = store.search(words, category_filter, start_date, end_date, limit, cursor)
+    return {
+        "status": "success",
+        "transactions": transactions,
+        "next_cursor": next_cursor
+    }
+
+@app.route('/api/changes', methods=['GET'])
+@versioned
+def get_changes():
+    """Get what changed after ?since=N, for clients keeping a local copy of the data"""
+    try:
+        return jsonify(query_changes(request.args))
+    except BudgetError as e:
+        return e.to_response()
+
+@app.route('/api/summary', methods=['GET'])
+@versioned
+def get_summary():
+    """Get totals per period (?group=day|week|month|year) and category, optionally filtered"""
+    try:
+        return jsonify(query_summary(request.args))
+    except BudgetError as e:
+        return e.to_response()
+
+def query_summary(args):
+    """Response body for GET /api/summary: deposits, withdrawals, transfers, net and count per period.
+
+    start and end are dates (YYYY-MM-DD) selecting the periods they fall in and those between.
+    """
+    group = args.get("group", "month")
+    if group not in ROLLUP_GROUPS:
+        raise BudgetError(f"group must be one of {', '.join(ROLLUP_GROUPS)}")
+    category = args.get("category")
+    if not category or category in ("All", "All Categories"):
+        category = None
+    bounds = []
+    for key in ("start", "end"):
+        value = args.get(key)
+        if value:
+            try:
+                value = datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+            except ValueError:
+                raise BudgetError("Invalid date")
+            value = rollup_periods(value)[ROLLUP_GROUPS.index(group)]
+        bounds.append(value or None)
+    return {
+        "status": "success",
+        "group": group,
+        "periods": store.summary(group, category, *bounds)
+    }
+
+def query_changes(args):
+    """Response body for GET /api/changes.
+
+    "changes" lists the mutations after since in order, each with its seq: add_category,
+    add_transactions (the new rows, ids included) and delete_category, which also deletes
+    the category's transactions. When those are no longer all logged, or ?store= names
+    another store than "store", the response is "compacted" instead and carries every
+    transaction. Either way "seq" is the version to ask from next time, along with "store",
+    and "categories" holds the balances as of that version.
+    """
+    try:
+        since = int(args.get("since", 0))
+    except ValueError:
+        raise BudgetError("Invalid since")
+    try:
+        store_id = int(args["store"], 16) if args.get("store") else None
+    except ValueError:
+        raise BudgetError("Invalid store")
+    own_id, version, changes, balances, transactions = store.changes_since(since, store_id)
+    response = {
+        "status": "success",
+        "store": f"{own_id:x}",
+        "since": since,
+        "seq": version,
+        "compacted": changes is None,
+        "categories": [{"name": name, "balance": balance} for name, balance in balances.items()]
+    }
+    if changes is None:
+        response["transactions"] = transactions
+    else:
+        response["changes"] = changes
+    return response
+
 @app.route('/api/transactions', methods=['POST'])
 def add_transaction():
     """Add a new transaction"""
     try:
-        data = load_data()
         category_name = request.json.get("category")
         amount = float(request.json.get("amount", 0))
         description = request.json.get("description", "").strip()
         transaction_type = request.json.get("type")
         
-        # Validation
-        if category_name not in data["categories"]:
-            return jsonify({"status": "error", "message": "Invalid category"}), 400
-            
-        if transaction_type not in ("deposit", "withdraw"):
-            return jsonify({"status": "error", "message": "Invalid transaction type"}), 400
-            
-        if amount <= 0:
-            return jsonify({"status": "error", "message": "Amount must be positive"}), 400
-            
-        current_balance = calculate_balance(data["categories"][category_name])
-        if transaction_type == "withdraw" and amount > current_balance:
-            return jsonify({
-                "status": "error",
-                "message": "Insufficient funds",
-                "current_balance": current_balance
-            }), 400
-            
-        # Create transaction
-        transaction = {
-            "amount": amount if transaction_type == "deposit" else -amount,
-            "description": description,
-            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "type": transaction_type,
-            "category": category_name
-        }
-        
-        # Update data
-        data["categories"][category_name]["ledger"].append(transaction)
-        data["transactions"].append(transaction)
-        
-        if save_data(data):
-            return jsonify({
-                "status": "success",
-                "message": "Transaction added",
-                "transaction": transaction,
-                "new_balance": calculate_balance(data["categories"][category_name])
-            })
-        return jsonify({"status": "error", "message": "Failed to save data"}), 500
+        # Validated and applied under the write lock, against the latest balances
+        mutations = writer.submit(
+            lambda store: plan_add_transaction(store, category_name, amount, description, transaction_type)
+        )
+        return jsonify({
+            "status": "success",
+            "message": "Transaction added",
+            "transaction": mutations[0]["transactions"][0],
+            "new_balance": store.balance(category_name)
+        })
         
+    except BudgetError as e:
+        return e.to_response()
     except ValueError:
         return jsonify({"status": "error", "message": "Invalid amount"}), 400
     except Exception as e:
@@ -199,158 +2668,155 @@ def add_transaction():
 def transfer_funds():
     """Transfer funds between categories"""
     try:
-        data = load_data()
         from_cat = request.json.get("from_category")
         to_cat = request.json.get("to_category")
         amount = float(request.json.get("amount", 0))
         
-        # Validation
-        if from_cat not in data["categories"] or to_cat not in data["categories"]:
-            return jsonify({"status": "error", "message": "Invalid categories"}), 400
-            
-        if amount <= 0:
-            return jsonify({"status": "error", "message": "Amount must be positive"}), 400
-            
-        from_balance = calculate_balance(data["categories"][from_cat])
-        if amount > from_balance:
-            return jsonify({
-                "status": "error",
-                "message": "Insufficient funds",
-                "current_balance": from_balance
-            }), 400
-            
-        # Create transactions
-        withdraw_transaction = {
-            "amount": -amount,
-            "description": f"Transfer to {to_cat}",
-            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "type": "transfer_out",
-            "category": from_cat
-        }
-        
-        deposit_transaction = {
-            "amount": amount,
-            "description": f"Transfer from {from_cat}",
-            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "type": "transfer_in",
-            "category": to_cat
-        }
-        
-        # Update data
-        data["categories"][from_cat]["ledger"].append(withdraw_transaction)
-        data["categories"][to_cat]["ledger"].append(deposit_transaction)
-        data["transactions"].extend([withdraw_transaction, deposit_transaction])
-        
-        if save_data(data):
-            return jsonify({
-                "status": "success",
-                "message": "Transfer completed",
-                "from_balance": calculate_balance(data["categories"][from_cat]),
-                "to_balance": calculate_balance(data["categories"][to_cat])
-            })
-        return jsonify({"status": "error", "message": "Failed to save data"}), 500
+        writer.submit(lambda store: plan_transfer(store, from_cat, to_cat, amount))
+        return jsonify({
+            "status": "success",
+            "message": "Transfer completed",
+            "from_balance": store.balance(from_cat),
+            "to_balance": store.balance(to_cat)
+        })
         
+    except BudgetError as e:
+        return e.to_response()
     except ValueError:
         return jsonify({"status": "error", "message": "Invalid amount"}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-# delete category
-@app.route('/api/categories/<category_name>', methods=['DELETE'])
-def delete_category(category_name):
+@app.route('/api/transactions/import', methods=['POST'])
+def import_transactions_endpoint():
+    """Bulk-add transactions from a CSV upload/body or a JSON array, committed all at once"""
     try:
-        data = load_data()
-        
-        # Check if category exists
-        if category_name not in data["categories"]:
-            return jsonify({
-                "status": "error",
-                "message": "Category not found"
-            }), 404
+        upload = request.files.get("file")
+        if upload is not None:
+            text = upload.read().decode("utf-8-sig")
+            is_json = upload.filename.lower().endswith(".json")
+        else:
+            text = request.get_data(as_text=True)
+            is_json = request.is_json
+        rows = read_import_rows(text, is_json)
+        imported, errors = import_transactions(rows)
+        return jsonify({
+            "status": "success" if imported or not errors else "error",
+            "message": f"Imported {len(imported)} of {len(rows)} transactions",
+            "imported": len(imported),
+            "errors": errors
+        }), 200 if imported or not errors else 400
 
-        # Delete the category
-        del data["categories"][category_name]
+    except BudgetError as e:
+        return e.to_response()
+    except (ValueError, csv.Error) as e:
+        return jsonify({"status": "error", "message": f"Could not parse import: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        # Remove all transactions for this category
-        data["transactions"] = [
-            t for t in data["transactions"] 
-            if t["category"] != category_name
-        ]
+@app.route('/api/batch', methods=['POST'])
+def batch_endpoint():
+    """Apply an ordered list of operations all-or-nothing, in one commit.
 
-        if save_data(data):
-            return jsonify({
-                "status": "success",
-                "message": f"Category '{category_name}' deleted"
-            })
-        else:
-            return jsonify({
-                "status": "error",
-                "message": "Failed to save data"
-            }), 500
+    Each operation names its op (add_category, add_transaction, transfer or delete_category)
+    along with the fields its own route takes, and sees the effect of those before it.
+    """
+    try:
+        operations = read_batch(request.get_json(silent=True))
+        steps = []
+        writer.submit(lambda store: plan_batch(store, operations, steps))
+        return jsonify(batch_response(operations, steps, store.balances()))
+
+    except BudgetError as e:
+        return e.to_response()
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.cli.command("import-transactions")
+@click.argument("path")
+def import_transactions_command(path):
+    """Bulk-add transactions from a CSV or JSON file in a single commit"""
+    with open(path, encoding="utf-8-sig") as f:
+        rows = read_import_rows(f.read(), path.lower().endswith(".json"))
+    imported, errors = import_transactions(rows)
+    for error in errors:
+        print(f"Row {error['row']}: {error['message']}")
+    print(f"Imported {len(imported)} of {len(rows)} transactions")
+
+# delete category
+@app.route('/api/categories/<category_name>', methods=['DELETE'])
+def delete_category(category_name):
+    try:
+        # Delete the category along with all of its transactions
+        writer.submit(lambda store: plan_delete_category(store, category_name))
+        return jsonify({
+            "status": "success",
+            "message": f"Category '{category_name}' deleted"
+        })
 
+    except BudgetError as e:
+        return e.to_response()
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """Push change events to the client as writes commit, as Server-Sent Events"""
+    try:
+        seq = events_start(request.headers.get("Last-Event-ID"), request.args.get("since"))
+    except BudgetError as e:
+        return e.to_response()
+
+    def generate():
+        nonlocal seq
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        while True:
+            events = change_feed.wait(seq, EVENTS_KEEPALIVE)
+            if events is None:
+                # The missed events are gone, the client has to start over from a fresh read
+                events = [{"type": "reset", "seq": change_feed.position()}]
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            yield "".join(format_event(event) for event in events)
+            seq = events[-1]["seq"]
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers['Cache-Control'] = 'no-cache'
+    # Ask proxies such as nginx not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def events_start(last_event_id, since):
+    """The data version an event stream starts after: the client's last event, or now"""
+    writer.start()  # Puts the change feed in step with the store
+    resume = last_event_id or since
+    if not resume:
+        return change_feed.position()
+    try:
+        return int(resume)
+    except ValueError:
+        raise BudgetError("Invalid event id")
+
+def format_event(event):
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
     
     # generate report in csv/text.......
 @app.route('/api/report', methods=['GET'])
 def generate_report():
     try:
-        # Get report parameters from request
-        report_type = request.args.get('type', 'txt')  # txt or csv
-        detailed = request.args.get('detailed', 'false').lower() == 'true'
-        date_range = request.args.get('range', 'all')
-        start_date = request.args.get('start')
-        end_date = request.args.get('end')
-        
-        # Validate and parse dates
-        if date_range == 'custom' and (not start_date or not end_date):
-            return jsonify({"error": "Custom range requires both start and end dates"}), 400
-            
-        # Calculate date range
-        now = datetime.now()
-        if date_range == 'today':
-            start_date = now.date()
-            end_date = now.date()
-        elif date_range == 'week':
-            start_date = now.date() - timedelta(days=now.weekday())
-            end_date = now.date()
-        elif date_range == 'month':
-            start_date = now.replace(day=1).date()
-            end_date = now.date()
-        elif date_range == 'year':
-            start_date = now.replace(month=1, day=1).date()
-            end_date = now.date()
-        
-        # Load and filter data
-        data = load_data()
-        
-        # Filter transactions by date if needed
-        if date_range != 'all':
-            transactions = []
-            for t in data.get('transactions', []):
-                t_date = datetime.strptime(t['date'], '%Y-%m-%d').date()
-                if t_date >= start_date and t_date <= end_date:
-                    transactions.append(t)
-            data['transactions'] = transactions
+        report_content, filename, content_type = prepare_report(request.args)
         
-        # Generate report content based on type
-        if report_type == 'csv':
-            report_content = generate_csv_report(data, detailed)
-            filename = f"budget_report_{datetime.now().strftime('%Y%m%d')}.csv"
-            content_type = 'text/csv'
-        else:
-            report_content = generate_text_report(data, detailed)
-            filename = f"budget_report_{datetime.now().strftime('%Y%m%d')}.txt"
-            content_type = 'text/plain'
-        
-        # Create response
-        response = make_response(report_content)
+        # Stream the response, the first rows go out before the rest are rendered
+        response = Response(stream_with_context(report_content))
         response.headers['Content-Type'] = content_type
         response.headers['Content-Disposition'] = f'attachment; filename={filename}'
         return response
         
+    except BudgetError as e:
+        return jsonify({"error": e.message}), e.status
     except Exception as e:
         app.logger.error(f"Report generation failed: {str(e)}\n{traceback.format_exc()}")
         return jsonify({
@@ -359,18 +2825,148 @@ def generate_report():
             "error": str(e)
         }), 500
 
-def generate_text_report(data, detailed=False):
-    """Generate text format report with complete balance information"""
-    report_lines = [
-        f"Budget Report - {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-        "=" * 100,
-        f"{'Date':<20} {'Category':<15} {'Type':<10} {'Amount':>10} {'description':>30}",
-        "-" * 100
-    ]
+def prepare_report(args):
+    """Report body (a generator of chunks), filename and content type for GET /api/report's parameters"""
+    report_type = args.get('type', 'txt')  # txt or csv
+    detailed = args.get('detailed', 'false').lower() == 'true'
+    date_range = args.get('range', 'all')
+    start_date = args.get('start')
+    end_date = args.get('end')
+    
+    # Validate and parse dates
+    if date_range == 'custom' and (not start_date or not end_date):
+        raise BudgetError("Custom range requires both start and end dates")
+        
+    # Calculate date range
+    now = datetime.now()
+    if date_range == 'today':
+        start_date = now.date()
+        end_date = now.date()
+    elif date_range == 'week':
+        start_date = now.date() - timedelta(days=now.weekday())
+        end_date = now.date()
+    elif date_range == 'month':
+        start_date = now.replace(day=1).date()
+        end_date = now.date()
+    elif date_range == 'year':
+        start_date = now.replace(month=1, day=1).date()
+        end_date = now.date()
+    elif date_range == 'custom':
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    
+    if date_range == 'all':
+        start_date = end_date = None
+    
+    # Relative ranges are resolved by now, so a cached "month" report is only reused within the month.
+    # The version is read before the data: a write landing in between only makes the entry unreachable
+    key = ('csv' if report_type == 'csv' else 'txt', detailed, start_date, end_date)
+    version = store.version()
+    cached = report_cache.get(version, key)
+    
+    if cached is not None:
+        report_content = cached_report(cached)
+    else:
+        # Balances are read up front; transactions are streamed, filtered by date if needed
+        balances = store.balances()
+        # Detailed reports close with analytics over the same range
+        analytics = report_analytics(start_date, end_date, balances) if detailed else None
+        if report_type == 'csv':
+            report_content = generate_csv_report(store.iter_transactions(start_date, end_date), balances, detailed, analytics)
+        else:
+            transactions = store.iter_transactions(start_date, end_date, by_date=True)
+            report_content = generate_text_report(transactions, balances, detailed, analytics)
+        report_content = report_cache.filling(version, key, report_content)
+    
+    if report_type == 'csv':
+        filename = f"budget_report_{datetime.now().strftime('%Y%m%d')}.csv"
+        content_type = 'text/csv'
+    else:
+        filename = f"budget_report_{datetime.now().strftime('%Y%m%d')}.txt"
+        content_type = 'text/plain'
+    return report_content, filename, content_type
+
+class ReportCache:
+    """Rendered reports for one data version, the least recently used dropped first when full.
+
+    Every write bumps the version, and the first lookup with a new version empties the cache,
+    since none of the reports in it can be served again.
+    """
+
+    def __init__(self, max_entries, max_size):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.version = None
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def switch(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.size = 0
+            self.version = version
+
+    def get(self, version, key):
+        if not self.max_entries:
+            return None
+        with self.lock:
+            self.switch(version)
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+        metrics.inc("budget_report_cache_misses_total" if body is None else "budget_report_cache_hits_total")
+        return body
+
+    def put(self, version, key, body):
+        if not self.max_entries or len(body) > self.max_size:
+            return
+        with self.lock:
+            self.switch(version)
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = body
+            self.size += len(body)
+            while len(self.entries) > self.max_entries or self.size > self.max_size:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= len(dropped)
+
+    def filling(self, version, key, chunks):
+        """Pass the chunks of a report through, keeping the report once it is complete"""
+        kept, size = [], 0
+        try:
+            for chunk in chunks:
+                if kept is not None:
+                    size += len(chunk)
+                    # Too big to keep: stop collecting rather than hold it all until the end
+                    if size > self.max_size or not self.max_entries:
+                        kept = None
+                    else:
+                        kept.append(chunk)
+                yield chunk
+        finally:
+            chunks.close()
+        # Only reached when the whole report went out, not when the client left half way
+        if kept is not None:
+            self.put(version, key, "".join(kept))
+
+report_cache = ReportCache(REPORT_CACHE_ENTRIES, REPORT_CACHE_BYTES)
+
+def cached_report(body):
+    yield body
+
+def generate_text_report(transactions, balances, detailed=False, analytics=None):
+    """Generate text format report with complete balance information, one line at a time"""
+    yield f"Budget Report - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+    yield "\n" + "=" * 100
+    yield "\n" + f"{'Date':<20} {'Category':<15} {'Type':<10} {'Amount':>10} {'description':>30}"
+    yield "\n" + "-" * 100
     
-    # Add transactions
-    for t in sorted(data.get('transactions', []), key=lambda x: x.get('date', '')):
-        report_lines.append(
+    # Add transactions (already in date order)
+    for t in transactions:
+        yield (
+            "\n"
             f"{t.get('date','N/A'):<20} "
             f"{t.get('category','Uncategorized'):<15} "
             f"{t.get('type','other'):<10} "
@@ -378,42 +2974,40 @@ def generate_text_report(data, detailed=False):
             f"{t.get('description', ''):<30}"
         )
     
-    # Add summary with properly calculated balances
-    report_lines.extend([
-        "\n" + "=" * 50,
-        "Category Balances:",
-        "-" * 50
-    ])
-    
-    # Calculate balances properly (same method as CSV report)
-    category_balances = {}
-    for cat_name, cat_data in data.get('categories', {}).items():
-        balance = calculate_balance(cat_data)
-        category_balances[cat_name] = balance
-        report_lines.append(f"{cat_name:<15} {balance:>15.2f}")
+    # Add summary from the running balances
+    yield "\n" + "\n" + "=" * 50
+    yield "\n" + "Category Balances:"
+    yield "\n" + "-" * 50
     
-    total_balance = sum(category_balances.values())
-    report_lines.extend([
-        "-" * 50,
-        f"{'Total Balance:':<15} {total_balance:>15.2f}",
-        "=" * 50
-    ])
+    for cat_name, balance in balances.items():
+        yield "\n" + f"{cat_name:<15} {balance:>15.2f}"
     
-    return "\n".join(report_lines)
+    total_balance = sum(balances.values())
+    yield "\n" + "-" * 50
+    yield "\n" + f"{'Total Balance:':<15} {total_balance:>15.2f}"
+    yield "\n" + "=" * 50
     
+    if analytics is not None:
+        yield from text_analytics(analytics)
+
+class RowBuffer:
+    """File-like target for csv.writer that hands back each formatted row"""
+
+    def write(self, value):
+        return value
+
 # generate reports
-def generate_csv_report(data, detailed=False):
-    """Generate CSV format report"""
+def generate_csv_report(transactions, balances, detailed=False, analytics=None):
+    """Generate CSV format report, one row at a time"""
     
-    output = StringIO()
-    writer = csv.writer(output)
+    writer = csv.writer(RowBuffer())
     
     # Write header
-    writer.writerow(['Date', 'Category', 'Type', 'Amount', 'Description'])
+    yield writer.writerow(['Date', 'Category', 'Type', 'Amount', 'Description'])
     
     # Write transactions
-    for t in data.get('transactions', []):
-        writer.writerow([
+    for t in transactions:
+        yield writer.writerow([
             t.get('date', ''),
             t.get('category', ''),
             t.get('type', ''),
@@ -421,24 +3015,222 @@ def generate_csv_report(data, detailed=False):
             t.get('description', '')
         ])
     
-    # Calculate and write summary
-    writer.writerow([])
-    writer.writerow(['Category', 'Balance'])
+    # Write summary from the running balances
+    yield writer.writerow([])
+    yield writer.writerow(['Category', 'Balance'])
     
-    # First calculate all balances
-    category_balances = {}
-    for cat_name, cat_data in data.get('categories', {}).items():
-        balance = calculate_balance(cat_data)
-        category_balances[cat_name] = balance
-        writer.writerow([cat_name, balance])
+    for cat_name, balance in balances.items():
+        yield writer.writerow([cat_name, balance])
     
-    writer.writerow([])
-    writer.writerow(['Total Balance', sum(category_balances.values())])
-    
-    return output.getvalue()
+    yield writer.writerow([])
+    yield writer.writerow(['Total Balance', sum(balances.values())])
     
+    if analytics is not None:
+        for row in csv_analytics(analytics):
+            yield writer.writerow(row)
+
+class ColumnView:
+    """The transactions as NumPy columns in table order: amount, date, category and description codes.
+
+    Built on first use and cached until the transactions change; when rows were only added,
+    the next view extends this one instead of reading every row again.
+    """
+
+    def __init__(self, rows, base=None):
+        categories = {name: i for i, name in enumerate(base.categories)} if base else {}
+        descriptions = {text: i for i, text in enumerate(base.descriptions)} if base else {}
+        amounts, dates, category_codes, description_codes, transfers = [], [], [], [], []
+        last_id = base.last_id if base else None
+        for t in rows:
+            amounts.append(t["amount"])
+            dates.append(t["date"])
+            category_codes.append(categories.setdefault(t["category"], len(categories)))
+            description_codes.append(descriptions.setdefault(t.get("description", ""), len(descriptions)))
+            transfers.append(t.get("type") in ("transfer_in", "transfer_out"))
+            last_id = t["id"]
+        columns = (
+            np.array(amounts, dtype=np.float64),
+            numpy_dates(dates),
+            np.array(category_codes, dtype=np.int32),
+            np.array(description_codes, dtype=np.int32),
+            np.array(transfers, dtype=bool)
+        )
+        if base:
+            columns = [np.concatenate(pair) for pair in zip(base.columns(), columns)]
+        self.amounts, self.dates, self.category_codes, self.description_codes, self.transfers = columns
+        self.categories = list(categories)
+        self.descriptions = list(descriptions)
+        self.size = len(self.amounts)
+        self.last_id = last_id
+        self.source = None
+
+    def columns(self):
+        return self.amounts, self.dates, self.category_codes, self.description_codes, self.transfers
+
+    def extended(self, rows):
+        return ColumnView(rows, base=self)
+
+def numpy_dates(dates):
+    """Stored date strings as datetime64[s], NaT for those that don't parse"""
+    try:
+        return np.array(dates, dtype="datetime64[s]")
+    except ValueError:
+        return np.array([date if date_epoch(date) != UNDATED else "NaT" for date in dates], dtype="datetime64[s]")
+
+def report_analytics(start_date, end_date, balances):
+    """Per-category totals, monthly trend, top spending and burn rate for a report's date range"""
+    if np is None:
+        return scan_analytics(store.iter_transactions(start_date, end_date), start_date, end_date, balances)
+    return column_analytics(store.column_view(), start_date, end_date, balances)
+
+def column_analytics(view, start_date, end_date, balances):
+    """report_analytics with vectorized group-bys over a ColumnView"""
+    amounts, dates, categories, descriptions, transfers = view.columns()
+    if start_date is not None:
+        start = np.datetime64(start_date.isoformat(), "s")
+        end = np.datetime64(end_date.isoformat(), "s") + np.timedelta64(86399, "s")
+        mask = (dates >= start) & (dates <= end)
+        amounts, dates, categories, descriptions, transfers = (column[mask] for column in view.columns())
+    deposits = np.where(~transfers & (amounts >= 0), amounts, 0.0)
+    withdrawals = np.where(~transfers & (amounts < 0), amounts, 0.0)
+
+    width = len(view.categories)
+    totals = zip(
+        np.bincount(categories, weights=deposits, minlength=width).tolist(),
+        np.bincount(categories, weights=withdrawals, minlength=width).tolist(),
+        np.bincount(categories, weights=np.where(transfers, amounts, 0.0), minlength=width).tolist(),
+        np.bincount(categories, minlength=width).tolist()
+    )
+    by_category = dict(zip(view.categories, totals))
+
+    # Months counted from the first one index the bins directly, no sort needed
+    dated = ~np.isnat(dates)
+    dates = dates[dated]
+    months = dates.astype("datetime64[M]").astype(np.int64)
+    first = months.min() if len(months) else 0
+    months -= first
+    present = np.flatnonzero(np.bincount(months))
+    trend = zip(
+        np.datetime_as_string((present + first).astype("datetime64[M]"), unit="M").tolist(),
+        np.bincount(months, weights=deposits[dated])[present].tolist(),
+        np.bincount(months, weights=withdrawals[dated])[present].tolist()
+    )
+
+    spent = np.bincount(descriptions, weights=-withdrawals, minlength=len(view.descriptions))
+    spent_count = np.bincount(descriptions, weights=withdrawals < 0, minlength=len(view.descriptions))
+    top = [i for i in np.argsort(-spent, kind="stable")[:TOP_DESCRIPTIONS].tolist() if spent[i] > 0]
+
+    if start_date is not None:
+        days = (end_date - start_date).days + 1
+    elif len(dates):
+        days = int((dates.max().astype("datetime64[D]") - dates.min().astype("datetime64[D]")).astype(int)) + 1
+    else:
+        days = 0
+    return {
+        "categories": [(name, *by_category.get(name, (0.0, 0.0, 0.0, 0))) for name in balances],
+        "months": list(trend),
+        "descriptions": [(view.descriptions[i], float(spent[i]), int(spent_count[i])) for i in top],
+        "days": days,
+        "spent": 0.0 - float(withdrawals.sum()),
+        "balance": sum(balances.values())
+    }
+
+def scan_analytics(transactions, start_date, end_date, balances):
+    """report_analytics in one pass over the transactions, for when NumPy isn't installed"""
+    by_category, months, descriptions = {}, {}, {}
+    first = last = None
+    spent = 0.0
+    for t in transactions:
+        amount = t["amount"]
+        kind = 2 if t.get("type") in ("transfer_in", "transfer_out") else 0 if amount >= 0 else 1
+        totals = by_category.setdefault(t["category"], [0.0, 0.0, 0.0, 0])
+        totals[kind] += amount
+        totals[3] += 1
+        if kind == 1:
+            spent -= amount
+            description = descriptions.setdefault(t.get("description", ""), [0.0, 0])
+            description[0] -= amount
+            description[1] += 1
+        day = t["date"][:10]
+        if date_epoch(day) == UNDATED:
+            continue  # In no month, as with NumPy
+        month = months.setdefault(t["date"][:7], [0.0, 0.0])
+        if kind < 2:
+            month[kind] += amount
+        first = day if first is None or day < first else first
+        last = day if last is None or day > last else last
+
+    if start_date is not None:
+        days = (end_date - start_date).days + 1
+    elif first is not None:
+        days = (datetime.fromisoformat(last) - datetime.fromisoformat(first)).days + 1
+    else:
+        days = 0
+    top = sorted(descriptions.items(), key=lambda item: -item[1][0])[:TOP_DESCRIPTIONS]
+    return {
+        "categories": [(name, *by_category.get(name, (0.0, 0.0, 0.0, 0))) for name in balances],
+        "months": [(month, *totals) for month, totals in sorted(months.items())],
+        "descriptions": [(text, total, count) for text, (total, count) in top if total > 0],
+        "days": days,
+        "spent": spent,
+        "balance": sum(balances.values())
+    }
+
+def burn_rate(analytics):
+    """Average spending per day over the range, and the days the total balance lasts at that rate"""
+    per_day = analytics["spent"] / analytics["days"] if analytics["days"] else 0.0
+    runway = analytics["balance"] / per_day if per_day > 0 else None
+    return per_day, runway
+
+def text_analytics(analytics):
+    """The analytics sections of a detailed text report"""
+    yield "\n" + "\n" + "=" * 70
+    yield "\n" + "Category Totals:"
+    yield "\n" + "-" * 70
+    yield "\n" + f"{'Category':<15} {'Deposits':>12} {'Withdrawals':>12} {'Transfers':>12} {'Count':>8}"
+    for name, deposits, withdrawals, transfers, count in analytics["categories"]:
+        yield "\n" + f"{name:<15} {deposits:>12.2f} {withdrawals:>12.2f} {transfers:>12.2f} {count:>8}"
+
+    yield "\n" + "\n" + "Monthly Trend:"
+    yield "\n" + "-" * 70
+    yield "\n" + f"{'Month':<15} {'Deposits':>12} {'Withdrawals':>12} {'Net':>12}"
+    for month, deposits, withdrawals in analytics["months"]:
+        yield "\n" + f"{month:<15} {deposits:>12.2f} {withdrawals:>12.2f} {deposits + withdrawals:>12.2f}"
+
+    yield "\n" + "\n" + "Top Spending:"
+    yield "\n" + "-" * 70
+    yield "\n" + f"{'Description':<30} {'Spent':>12} {'Count':>8}"
+    for description, spent, count in analytics["descriptions"]:
+        yield "\n" + f"{description:<30} {spent:>12.2f} {count:>8}"
+
+    per_day, runway = burn_rate(analytics)
+    yield "\n" + "\n" + "Burn Rate:"
+    yield "\n" + "-" * 70
+    yield "\n" + f"{'Days:':<15} {analytics['days']:>15}"
+    yield "\n" + f"{'Spent:':<15} {analytics['spent']:>15.2f}"
+    yield "\n" + f"{'Per Day:':<15} {per_day:>15.2f}"
+    yield "\n" + f"{'Runway (days):':<15} {'-' if runway is None else f'{runway:.1f}':>15}"
+    yield "\n" + "=" * 70
+
+def csv_analytics(analytics):
+    """The analytics sections of a detailed CSV report, as rows"""
+    yield []
+    yield ['Category', 'Deposits', 'Withdrawals', 'Transfers', 'Count']
+    yield from ([*row] for row in analytics["categories"])
+    yield []
+    yield ['Month', 'Deposits', 'Withdrawals', 'Net']
+    yield from ([month, deposits, withdrawals, deposits + withdrawals] for month, deposits, withdrawals in analytics["months"])
+    yield []
+    yield ['Description', 'Spent', 'Count']
+    yield from ([*row] for row in analytics["descriptions"])
+    per_day, runway = burn_rate(analytics)
+    yield []
+    yield ['Days', 'Spent', 'Per Day', 'Runway Days']
+    yield [analytics["days"], analytics["spent"], per_day, '' if runway is None else runway]
 
     
 if __name__ == "__main__":
     ensure_data_file()  # Initialize on startup
+    if STORAGE_MODE == "journal":
+        checkpoint(load_data)  # Start from a compact snapshot
     app.run(debug=True)
\ No newline at end of file
@@ -43,9 +43,10 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    // Load all data when page loads
+    // Load all data when page loads, then follow changes as they happen
     loadCategories();
     loadTransactionHistory();
+    subscribeToChanges();
     
     // Event Listeners
     elements.forms.addCategory?.addEventListener('submit', handleAddCategory);
@@ -92,6 +93,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 const dropdowns = [elements.transactionCategory, elements.fromCategory, elements.toCategory, elements.historyCategory]
                     .filter(dropdown => dropdown); // Filter out null elements
                 
+                // Keep what the user picked, changes pushed from elsewhere shouldn't reset the forms
+                const selected = dropdowns.map(select => select.value);
                 dropdowns.forEach(select => {
                     while (select.options.length > 1) select.remove(1);
                 });
@@ -111,9 +114,10 @@ document.addEventListener('DOMContentLoaded', function() {
                     if (elements.categoriesList) {
                         const li = document.createElement('li');
                         li.className = 'list-group-item d-flex justify-content-between align-items-center';
+                        li.dataset.category = category.name;
                         li.innerHTML = `
                             ${category.name}
-                            <span class="badge bg-primary rounded-pill">${category.balance.toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2})}</span>
+                            <span class="badge bg-primary rounded-pill">${formatMoney(category.balance)}</span>
                             <button class="btn btn-sm btn-danger delete-category" data-name="${category.name}">Delete</button>
                         `;
                         elements.categoriesList.appendChild(li);
@@ -125,6 +129,9 @@ document.addEventListener('DOMContentLoaded', function() {
                         select.add(option.cloneNode(true));
                     });
                 });
+                dropdowns.forEach((select, i) => {
+                    if ([...select.options].some(option => option.value === selected[i])) select.value = selected[i];
+                });
                 
                 // Add event listeners to delete buttons
                 document.querySelectorAll('.delete-category').forEach(button => {
@@ -142,7 +149,10 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
 
-    // Load transaction history
+    // Number of transactions fetched per page of history
+    const HISTORY_PAGE_SIZE = 50;
+
+    // Load transaction history (first page)
     function loadTransactionHistory() {
         if (!elements.historyCategory || !elements.transactionHistory) {
             console.error('History elements not found');
@@ -163,7 +173,23 @@ document.addEventListener('DOMContentLoaded', function() {
             </tr>
         `;
     
-        fetch('/api/transactions')
+        loadTransactionPage(selectedCategory, null);
+    }
+
+    // Fetch one page of history (newest first) and append it to the table
+    function loadTransactionPage(selectedCategory, cursor) {
+        const params = new URLSearchParams({
+            limit: HISTORY_PAGE_SIZE,
+            fields: 'id,date,category,description,amount'
+        });
+        if (selectedCategory && selectedCategory !== 'All') {
+            params.append('category', selectedCategory);
+        }
+        if (cursor !== null) {
+            params.append('cursor', cursor);
+        }
+
+        fetch(`/api/transactions?${params.toString()}`)
             .then(response => {
                 if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
                 return response.json();
@@ -171,45 +197,44 @@ document.addEventListener('DOMContentLoaded', function() {
             .then(data => {
                 if (!data.transactions) throw new Error('Invalid data format: transactions missing');
                 
-                elements.transactionHistory.innerHTML = '';
-                
-                // Filter transactions by selected category if specified
-                let transactions = data.transactions;
-                if (selectedCategory && selectedCategory !== 'All') {
-                    transactions = transactions.filter(t => t.category === selectedCategory);
+                // First page replaces the loading row, later pages replace the "Load more" row
+                if (cursor === null) {
+                    elements.transactionHistory.innerHTML = '';
+                } else {
+                    elements.transactionHistory.querySelector('.load-more-row')?.remove();
                 }
                 
-                // Sort by date (newest first)
-                transactions.sort((a, b) => new Date(b.date) - new Date(a.date));
+                // Pages arrive newest first, already filtered by category
+                const transactions = data.transactions;
                 
                 // Display transactions
-                if (transactions.length === 0) {
+                if (transactions.length === 0 && cursor === null) {
                     const row = document.createElement('tr');
+                    row.className = 'empty-row';
                     row.innerHTML = `<td colspan="4" class="text-center">No transactions found</td>`;
                     elements.transactionHistory.appendChild(row);
                     return;
                 }
                 
                 transactions.forEach(transaction => {
+                    elements.transactionHistory.appendChild(createTransactionRow(transaction));
+                });
+                
+                // Older pages are only fetched on demand
+                if (data.next_cursor !== null && data.next_cursor !== undefined) {
                     const row = document.createElement('tr');
-                    const amountClass = transaction.amount >= 0 ? 'text-success' : 'text-danger';
-                    const amountSign = transaction.amount >= 0 ? '+' : '';
-                    const formattedDate = new Date(transaction.date).toLocaleDateString('en-US', {
-                        year: 'numeric',
-                        month: 'short',
-                        day: 'numeric',
-                        hour: '2-digit',
-                        minute: '2-digit'
-                    });
-                    
+                    row.className = 'load-more-row';
                     row.innerHTML = `
-                        <td>${formattedDate}</td>
-                        <td>${transaction.category}</td>
-                        <td>${transaction.description || '-'}</td>
-                        <td class="${amountClass} fw-bold">${amountSign}${Math.abs(transaction.amount).toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2})}</td>
+                        <td colspan="4" class="text-center">
+                            <button class="btn btn-sm btn-outline-primary">Load more</button>
+                        </td>
                     `;
+                    row.querySelector('button').addEventListener('click', function() {
+                        this.disabled = true;
+                        loadTransactionPage(selectedCategory, data.next_cursor);
+                    });
                     elements.transactionHistory.appendChild(row);
-                });
+                }
             })
             .catch(error => {
                 console.error('Error loading transaction history:', error);
@@ -223,6 +248,76 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
+    // One row of the history table
+    function createTransactionRow(transaction) {
+        const row = document.createElement('tr');
+        const amountClass = transaction.amount >= 0 ? 'text-success' : 'text-danger';
+        const amountSign = transaction.amount >= 0 ? '+' : '';
+        const formattedDate = new Date(transaction.date).toLocaleDateString('en-US', {
+            year: 'numeric',
+            month: 'short',
+            day: 'numeric',
+            hour: '2-digit',
+            minute: '2-digit'
+        });
+        
+        row.innerHTML = `
+            <td>${formattedDate}</td>
+            <td>${transaction.category}</td>
+            <td>${transaction.description || '-'}</td>
+            <td class="${amountClass} fw-bold">${amountSign}${formatMoney(Math.abs(transaction.amount))}</td>
+        `;
+        return row;
+    }
+
+    function formatMoney(value) {
+        return value.toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+    }
+
+    // True while the change stream is connected: the page then follows every write through
+    // it, this tab's own included, instead of reloading after each form submit
+    let liveUpdates = false;
+
+    // Follow changes pushed by the server as writes commit
+    function subscribeToChanges() {
+        if (!window.EventSource) return;
+
+        // The browser reconnects by itself, resuming after the last event it received
+        const source = new EventSource('/api/events');
+        source.addEventListener('open', () => { liveUpdates = true; });
+        source.addEventListener('error', () => { liveUpdates = false; });
+
+        source.addEventListener('category_added', () => loadCategories());
+        source.addEventListener('transactions_added', applyTransactionsEvent);
+        source.addEventListener('transfer', applyTransactionsEvent);
+        ['category_deleted', 'reset'].forEach(type => {
+            source.addEventListener(type, () => {
+                loadCategories();
+                loadTransactionHistory();
+            });
+        });
+    }
+
+    // New transactions only need the touched balances updated and rows added on top
+    function applyTransactionsEvent(e) {
+        const event = JSON.parse(e.data);
+
+        Object.entries(event.balances).forEach(([name, balance]) => {
+            const item = [...(elements.categoriesList?.children || [])].find(li => li.dataset.category === name);
+            const badge = item?.querySelector('.badge');
+            if (badge) badge.textContent = formatMoney(balance);
+        });
+
+        if (!elements.transactionHistory || !elements.historyCategory) return;
+        const selectedCategory = elements.historyCategory.value;
+        event.transactions
+            .filter(transaction => !selectedCategory || selectedCategory === 'All' || transaction.category === selectedCategory)
+            .forEach(transaction => {
+                elements.transactionHistory.querySelector('.empty-row')?.remove();
+                elements.transactionHistory.prepend(createTransactionRow(transaction));
+            });
+    }
+    
     // Handle add category
     function handleAddCategory(e) {
         e.preventDefault();
@@ -250,7 +345,7 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             if (data.status === 'success') {
                 nameInput.value = '';
-                loadCategories();
+                if (!liveUpdates) loadCategories();
             }
             alert(data.message || 'Category added successfully');
         })
@@ -303,8 +398,10 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             if (data.status === 'success') {
                 if (elements.forms.transaction) elements.forms.transaction.reset();
-                loadCategories();
-                loadTransactionHistory();
+                if (!liveUpdates) {
+                    loadCategories();
+                    loadTransactionHistory();
+                }
             }
             alert(data.message || 'Transaction added successfully');
         })
@@ -350,8 +447,10 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             if (data.status === 'success') {
                 if (elements.forms.transfer) elements.forms.transfer.reset();
-                loadCategories();
-                loadTransactionHistory();
+                if (!liveUpdates) {
+                    loadCategories();
+                    loadTransactionHistory();
+                }
             }
             alert(data.message || 'Transfer completed successfully');
         })
@@ -482,8 +581,10 @@ document.addEventListener('DOMContentLoaded', function() {
         })
         .then(data => {
             if (data.status === 'success') {
-                loadCategories();
-                loadTransactionHistory();
+                if (!liveUpdates) {
+                    loadCategories();
+                    loadTransactionHistory();
+                }
             }
             alert(data.message || 'Category deleted successfully');
         })